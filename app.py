@@ -4,16 +4,117 @@ Uses PostgreSQL (via DATABASE_URL env var) for persistent key storage.
 Falls back to keys.json if no DATABASE_URL is set (local dev).
 """
 
-from flask import Flask, request, jsonify, render_template_string, Response
-import json, os, re
+from flask import Flask, request, jsonify, render_template_string, Response, has_request_context, g
+import array, atexit, bisect, collections, contextlib, functools, hashlib, ipaddress, json, math, os, random, re, select, sqlite3, sys, tempfile, threading, time
 from datetime import datetime, timedelta, timezone
+import keycodec, querylog
+from querylog import run_query
 
 app = Flask(__name__)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR   = os.environ.get("DATA_DIR", SCRIPT_DIR)  # where local-mode files live
 LUA_FILE   = os.path.join(SCRIPT_DIR, "LegendLuaHub.lua")
-KEYS_FILE  = os.path.join(SCRIPT_DIR, "keys.json")  # local fallback only
+KEYS_FILE  = os.path.join(DATA_DIR, "keys.json")  # local fallback only
+CHANGES_FILE = os.path.join(DATA_DIR, "keys_changes.json")  # local change-feed state
+EVENTS_FILE  = os.path.join(DATA_DIR, "events.jsonl")       # local event log
+GEN_JOBS_FILE = os.path.join(DATA_DIR, "gen_jobs.json")     # local generation jobs
+TRACE_FILE   = os.environ.get("TRACE_FILE", os.path.join(DATA_DIR, "traces.jsonl"))
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
+DB_CONNECT_TIMEOUT      = int(os.environ.get("DB_CONNECT_TIMEOUT", 5))           # seconds
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 10000))  # 0 = none
+
+# Change feed: max rows per /admin/changes page, SSE poll interval and stream
+# lifetime (kept under gunicorn's default 30s worker timeout; clients reconnect).
+CHANGES_LIMIT          = int(os.environ.get("CHANGES_LIMIT", 500))
+CHANGES_POLL_SECONDS   = float(os.environ.get("CHANGES_POLL_SECONDS", 2))
+CHANGES_STREAM_SECONDS = float(os.environ.get("CHANGES_STREAM_SECONDS", 25))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get("TOMBSTONE_RETENTION_DAYS", 7))
+
+# Event log: per-worker buffer size (events beyond it are dropped and counted)
+# and how often the background thread flushes it.
+EVENT_BUFFER_SIZE   = int(os.environ.get("EVENT_BUFFER_SIZE", 5000))
+EVENT_FLUSH_SECONDS = float(os.environ.get("EVENT_FLUSH_SECONDS", 2))
+
+# Admission control (per worker): total request slots shared by all classes,
+# then per class "priority,concurrency,queue" — lower priority number wins a
+# freed slot. Requests that can't get a slot within ADMIT_WAIT_SECONDS, or find
+# their queue full, are shed with 503 + Retry-After.
+ADMIT_TOTAL        = int(os.environ.get("ADMIT_TOTAL", 8))
+ADMIT_WAIT_SECONDS = float(os.environ.get("ADMIT_WAIT_SECONDS", 1.5))
+ADMIT_RETRY_AFTER  = int(os.environ.get("ADMIT_RETRY_AFTER", 2))
+# Key snapshot: each worker keeps a read-only copy of the keys table, refreshed
+# from the change feed every SNAPSHOT_REFRESH_SECONDS (0 disables) and rebuilt
+# from a full scan every SNAPSHOT_FULL_SECONDS. Used when the database is down.
+SNAPSHOT_REFRESH_SECONDS = float(os.environ.get("SNAPSHOT_REFRESH_SECONDS", 30))
+SNAPSHOT_FULL_SECONDS    = float(os.environ.get("SNAPSHOT_FULL_SECONDS", 3600))
+# After a database failure those reads go straight to the snapshot for this
+# long instead of each waiting out the connect/statement timeout.
+DB_BREAKER_SECONDS       = float(os.environ.get("DB_BREAKER_SECONDS", 10))
+
+# Tracing: per-phase durations go out in a Server-Timing header ("admin" routes
+# only by default, "all", or "0"); a sample of requests (plus any slower than
+# TRACE_SLOW_MS) get their full span list appended to TRACE_FILE, which stops
+# growing at TRACE_MAX_BYTES.
+SERVER_TIMING     = os.environ.get("SERVER_TIMING", "admin")  # "1" means "all"
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_SLOW_MS     = float(os.environ.get("TRACE_SLOW_MS", 0))  # 0 = off
+TRACE_MAX_BYTES   = int(os.environ.get("TRACE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Traffic capture for replay_traffic.py: when set, every player/admin request
+# is appended to this file with hashed keys, users and client addresses. The
+# salt is required: unsalted hashes of IPv4 addresses and numeric userIds can
+# be reversed by trying them all. Keep it secret and don't reuse it.
+TRAFFIC_CAPTURE_FILE = os.environ.get("TRAFFIC_CAPTURE_FILE", "")
+TRAFFIC_CAPTURE_SALT = os.environ.get("TRAFFIC_CAPTURE_SALT", "")
+
+# Per-worker key cache (0 disables). Writes publish invalidations on a Postgres
+# NOTIFY channel so long TTLs stay safe across workers and nodes.
+KEY_CACHE_TTL        = float(os.environ.get("KEY_CACHE_TTL", 0))
+KEY_CACHE_SIZE       = int(os.environ.get("KEY_CACHE_SIZE", 50000))
+INVALIDATION_CHANNEL = os.environ.get("INVALIDATION_CHANNEL", "legendlua_keys")
+
+# Dashboard rollups: how often each worker flushes its counters (and advances
+# the expiry watermark).
+ROLLUP_FLUSH_SECONDS = float(os.environ.get("ROLLUP_FLUSH_SECONDS", 15))
+
+# Rate limits: token buckets per (route, key) and (route, client IP), given as
+# "tokens_per_second,burst" ("0" disables one). Buckets live in a SQLite file
+# shared by every worker on the node, or per worker with RATE_LIMIT_STORE=memory.
+RATE_LIMITS = {
+    (route, dim): tuple(float(x) for x in os.environ.get(f"RATE_{route.upper()}_{dim.upper()}", default).split(","))
+    for route, dim, default in (("hub", "key", "0.5,10"), ("hub", "ip", "2,30"),
+                                ("verify", "key", "2,20"), ("verify", "ip", "5,60"),
+                                ("verify_batch", "ip", "2,20"))
+}
+RATE_LIMIT_STORE       = os.environ.get("RATE_LIMIT_STORE", "sqlite")
+# Proxies in front of the app that append to X-Forwarded-For (Railway: 1).
+# The client address is that many entries from the end; anything before it
+# was sent by the client. 0 ignores the header.
+PROXY_HOPS             = int(os.environ.get("PROXY_HOPS", 1))
+RATE_LIMIT_DB          = os.environ.get("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "legendlua_ratelimit.db"))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", 100000))
+
+# How long one /admin/stats result is shared by concurrent/following requests.
+STATS_CACHE_SECONDS = float(os.environ.get("STATS_CACHE_SECONDS", 2))
+
+VERIFY_BATCH_MAX = int(os.environ.get("VERIFY_BATCH_MAX", 1000))  # pairs per /verify/batch
+
+# Large key batches (/admin/jobs) run on a small per-worker thread pool, one
+# transaction per chunk; idle threads look for queued jobs every
+# GEN_JOB_POLL_SECONDS. A running job not updated for GEN_JOB_STALL_SECONDS
+# (its worker died) is reported as stalled and picked up again by the next
+# idle thread, resuming from its last committed chunk.
+GEN_JOB_THREADS       = int(os.environ.get("GEN_JOB_THREADS", 2))
+GEN_JOB_CHUNK         = int(os.environ.get("GEN_JOB_CHUNK", 5000))
+GEN_JOB_POLL_SECONDS  = float(os.environ.get("GEN_JOB_POLL_SECONDS", 5))
+GEN_JOB_MAX           = int(os.environ.get("GEN_JOB_MAX", 500000))
+GEN_JOB_STALL_SECONDS = float(os.environ.get("GEN_JOB_STALL_SECONDS", 120))
+
+ADMIT_CLASSES = {
+    name: tuple(int(x) for x in os.environ.get(f"ADMIT_{name.upper()}", default).split(","))
+    for name, default in (("verify", "0,8,8"), ("verify_batch", "1,2,2"), ("hub", "1,4,4"), ("admin", "2,2,2"))
+}
 
 TIERS = {
     "1day":    {"label": "1 Day",    "days": 1},
@@ -35,7 +136,9 @@ def get_db():
     # Railway gives postgres:// but psycopg2 needs postgresql://
     if url.startswith("postgres://"):
         url = url.replace("postgres://", "postgresql://", 1)
-    conn = psycopg2.connect(url)
+    options = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}" if DB_STATEMENT_TIMEOUT_MS else None
+    with span("db_connect"):
+        conn = psycopg2.connect(url, connect_timeout=DB_CONNECT_TIMEOUT, options=options)
     return conn
 
 def init_db():
@@ -45,9 +148,14 @@ def init_db():
     try:
         conn = get_db()
         cur  = conn.cursor()
-        cur.execute("""
+        # Schema changes and the key id migration can outlast the per-statement
+        # timeout, and so can waiting for another worker's; lift it for this
+        # transaction. Every worker runs init_db at boot; one at a time.
+        run_query(cur, "SET LOCAL statement_timeout = 0")
+        run_query(cur, "SELECT pg_advisory_xact_lock(hashtext('legendlua_init_db'))")
+        run_query(cur, """
             CREATE TABLE IF NOT EXISTS keys (
-                key             TEXT PRIMARY KEY,
+                key_id          BIGINT PRIMARY KEY,
                 tier            TEXT NOT NULL,
                 tier_label      TEXT NOT NULL,
                 days            INTEGER,
@@ -59,84 +167,629 @@ def init_db():
                 created_at      TIMESTAMPTZ DEFAULT NOW()
             )
         """)
+        # Change feed: every write stamps its transaction id (write_xid) and a
+        # seq from one shared sequence (order within a transaction); deletes
+        # leave a tombstone so /admin/changes can report them. Rows from
+        # before write_xid existed get 0, which every cursor is past.
+        run_query(cur, "CREATE SEQUENCE IF NOT EXISTS key_change_seq")
+        run_query(cur, "ALTER TABLE keys ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW()")
+        run_query(cur, "ALTER TABLE keys ADD COLUMN IF NOT EXISTS seq BIGINT DEFAULT nextval('key_change_seq')")
+        run_query(cur, "DROP INDEX IF EXISTS keys_seq_idx")
+        run_query(cur, """
+            CREATE TABLE IF NOT EXISTS key_tombstones (
+                seq         BIGINT PRIMARY KEY DEFAULT nextval('key_change_seq'),
+                key_id      BIGINT NOT NULL,
+                deleted_at  TIMESTAMPTZ DEFAULT NOW()
+            )
+        """)
+        try:
+            migrate_key_ids(cur)
+        except Exception as e:
+            raise MigrationError(f"key id migration failed: {e}") from e
+        for table in ("keys", "key_tombstones"):
+            run_query(cur, f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS write_xid BIGINT NOT NULL DEFAULT 0")
+            run_query(cur, f"ALTER TABLE {table} ALTER COLUMN write_xid SET DEFAULT pg_current_xact_id()::text::bigint")
+            run_query(cur, f"CREATE INDEX IF NOT EXISTS {table}_write_xid_idx ON {table} (write_xid)")
+        run_query(cur, "DELETE FROM key_tombstones WHERE deleted_at < NOW() - %s * INTERVAL '1 day'",
+                    (TOMBSTONE_RETENTION_DAYS,))
+        run_query(cur, """
+            CREATE TABLE IF NOT EXISTS events (
+                id       BIGSERIAL PRIMARY KEY,
+                at       TIMESTAMPTZ NOT NULL,
+                kind     TEXT NOT NULL,
+                key      TEXT,
+                user_id  TEXT,
+                ip       TEXT,
+                route    TEXT,
+                detail   TEXT
+            )
+        """)
+        run_query(cur, "CREATE INDEX IF NOT EXISTS events_kind_at_idx ON events (kind, at)")
+        run_query(cur, "CREATE INDEX IF NOT EXISTS events_key_idx ON events (key)")
+        # Rollups: buckets are UTC timestamps truncated to the hour/day.
+        run_query(cur, """
+            CREATE TABLE IF NOT EXISTS key_rollups (
+                granularity TEXT NOT NULL,
+                bucket      TIMESTAMP NOT NULL,
+                tier        TEXT NOT NULL,
+                generated   INTEGER NOT NULL DEFAULT 0,
+                activated   INTEGER NOT NULL DEFAULT 0,
+                expired     INTEGER NOT NULL DEFAULT 0,
+                locked      INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket, tier)
+            )
+        """)
+        run_query(cur, """
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name       TEXT PRIMARY KEY,
+                watermark  TIMESTAMPTZ NOT NULL
+            )
+        """)
+        run_query(cur, "CREATE INDEX IF NOT EXISTS keys_expires_at_idx ON keys (expires_at)")
+        # Generation jobs: keys remember the job that made them for the download.
+        run_query(cur, """
+            CREATE TABLE IF NOT EXISTS gen_jobs (
+                id           TEXT PRIMARY KEY,
+                tier         TEXT NOT NULL,
+                requested    INTEGER NOT NULL,
+                done         INTEGER NOT NULL DEFAULT 0,
+                state        TEXT NOT NULL DEFAULT 'queued',
+                error        TEXT,
+                created_at   TIMESTAMPTZ DEFAULT NOW(),
+                started_at   TIMESTAMPTZ,
+                finished_at  TIMESTAMPTZ,
+                updated_at   TIMESTAMPTZ DEFAULT NOW()
+            )
+        """)
+        run_query(cur, "ALTER TABLE keys ADD COLUMN IF NOT EXISTS job_id TEXT")
+        run_query(cur, "CREATE INDEX IF NOT EXISTS keys_job_id_idx ON keys (job_id) WHERE job_id IS NOT NULL")
+        backfill_rollups(cur)
         conn.commit()
         cur.close()
         conn.close()
         print("[LegendLua] Database initialized.")
+    except MigrationError:
+        # Every query filters on key_id: serving against the old TEXT key
+        # column would answer "Key not found" to everyone. Don't boot.
+        raise
     except Exception as e:
         print(f"[LegendLua] DB init error: {e}")
 
+class MigrationError(Exception):
+    """The key id migration failed; the table still has the old schema."""
+
+def migrate_key_ids(cur):
+    """Move tables created with a TEXT key column to BIGINT key_id (keycodec).
+
+    Runs inside init_db's transaction, which holds the init lock and has no
+    statement timeout.
+    """
+    import psycopg2.extras
+    for table in ("keys", "key_tombstones"):
+        run_query(cur, """
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'key'
+        """, (table,))
+        if cur.fetchone() is None:
+            continue
+        run_query(cur, f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS key_id BIGINT")
+        run_query(cur, f"SELECT DISTINCT key FROM {table} WHERE key_id IS NULL")
+        legacy = [r[0] for r in cur.fetchall()]
+        bad = [k for k in legacy if keycodec.parse(k) is None]
+        if bad and table == "keys":
+            raise ValueError(f"keys: {len(bad)} key(s) can't be encoded, e.g. {bad[:5]}; fix or delete them")
+        if bad:
+            # Tombstones only feed the change feed; drop the unencodable ones.
+            run_query(cur, "DELETE FROM key_tombstones WHERE key = ANY(%s)", (bad,))
+            legacy = [k for k in legacy if keycodec.parse(k) is not None]
+        sql = f"UPDATE {table} SET key_id = v.key_id FROM (VALUES %s) AS v(key, key_id) WHERE {table}.key = v.key"
+        values = [(k, keycodec.encode(k)) for k in legacy]
+        with querylog.timed(cur, sql, [values], explain=False):
+            psycopg2.extras.execute_values(cur, sql, values, page_size=1000)
+        if table == "keys":
+            run_query(cur, "ALTER TABLE keys DROP CONSTRAINT IF EXISTS keys_pkey")
+            run_query(cur, "ALTER TABLE keys ADD PRIMARY KEY (key_id)")
+        else:
+            run_query(cur, "ALTER TABLE key_tombstones ALTER COLUMN key_id SET NOT NULL")
+        run_query(cur, f"ALTER TABLE {table} DROP COLUMN key")
+        print(f"[LegendLua] Migrated {len(legacy)} {table} row(s) to integer key ids.")
+
+# ── Request tracing ───────────────────────────────────────────────────────────
+_trace_lock = threading.Lock()
+
+@contextlib.contextmanager
+def span(name):
+    """Time a phase of the current request (no-op outside a request)."""
+    if not has_request_context() or "trace_start" not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.spans.append((name, start - g.trace_start, time.perf_counter() - start))
+
+def traced(name):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+@app.before_request
+def start_trace():
+    g.trace_start = time.perf_counter()
+    g.trace_wall  = time.time()
+    g.spans = []
+
+@app.after_request
+def finish_trace(response):
+    if "trace_start" not in g:
+        return response
+    total = time.perf_counter() - g.trace_start
+    if SERVER_TIMING in ("all", "1") or (SERVER_TIMING == "admin" and request.path.startswith("/admin")):
+        # Repeated phases (e.g. two db_connect) are summed into one entry.
+        totals = collections.OrderedDict()
+        for name, _, dur in g.spans:
+            totals[name] = totals.get(name, 0) + dur
+        parts = [f"{name};dur={dur * 1000:.2f}" for name, dur in totals.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(parts)
+    slow = TRACE_SLOW_MS and total * 1000 >= TRACE_SLOW_MS
+    if slow or (TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE):
+        trace = {
+            "at": datetime.now(timezone.utc).isoformat(), "pid": os.getpid(),
+            "method": request.method, "path": request.path, "status": response.status_code,
+            "total_ms": round(total * 1000, 3), "slow": bool(slow),
+            "spans": [{"name": n, "start_ms": round(st * 1000, 3), "dur_ms": round(d * 1000, 3)}
+                      for n, st, d in g.spans],
+        }
+        try:
+            with _trace_lock, open(TRACE_FILE, "a") as f:
+                if f.tell() < TRACE_MAX_BYTES:
+                    f.write(json.dumps(trace) + "\n")
+        except OSError as e:
+            print(f"[Trace] write error: {e}")
+    return response
+
+querylog.configure(get_db)
+
+# ── Single-flight ─────────────────────────────────────────────────────────────
+class SingleFlight:
+    """Concurrent calls for the same key share one execution and its result.
+
+    With ttl, the result is also reused by calls arriving within ttl
+    seconds. Callers must treat results as read-only.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done  = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = self.executions = self.shared = self.cached = 0
+        self._inflight = {}
+        self._results  = {}  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, ttl=0):
+        with self._lock:
+            self.calls += 1
+            if ttl:
+                hit = self._results.get(key)
+                if hit and hit[0] > time.monotonic():
+                    self.cached += 1
+                    return hit[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = self._Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            with span("singleflight_wait"):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if ttl and call.error is None:
+                    now = time.monotonic()
+                    self._results[key] = (now + ttl, call.value)
+                    if len(self._results) > 1000:
+                        self._results = {k: v for k, v in self._results.items() if v[0] > now}
+            call.done.set()
+        return call.value
+
+    def forget(self, key):
+        with self._lock:
+            self._results.pop(key, None)
+
+    def stats(self):
+        saved = self.calls - self.executions
+        return {"calls": self.calls, "executions": self.executions, "shared": self.shared,
+                "cached": self.cached, "coalesced_ratio": round(saved / self.calls, 3) if self.calls else 0}
+
+key_flight   = SingleFlight()
+stats_flight = SingleFlight()
+
+# ── Traffic capture ───────────────────────────────────────────────────────────
+# Response text -> outcome code, so replays can compare behaviour, not just status.
+CAPTURE_OUTCOMES = (
+    ("Missing key",          "missing"),
+    ("not found",            "unknown"),
+    ("Invalid key",          "unknown"),
+    ("No key provided",      "missing"),
+    ("expired",              "expired"),
+    ("linked to another",    "conflict"),
+    ("Too many requests",    "throttled"),
+    ("Server busy",          "busy"),
+    ("Unauthorized",         "unauthorized"),
+)
+
+def capture_hash(value):
+    if not value:
+        return None
+    return hashlib.sha256((TRAFFIC_CAPTURE_SALT + value).encode()).hexdigest()[:16]
+
+class TrafficCapture:
+    """Appends one compact JSON line per request to TRAFFIC_CAPTURE_FILE.
+
+    Lines are buffered per worker and written with a single O_APPEND write
+    so workers sharing the file don't interleave partial lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._buf = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, response, started, duration):
+        body = request.get_json(silent=True) if request.method == "POST" else None
+        body = body if isinstance(body, dict) else {}
+        rec = {"t": round(started, 3), "m": request.method, "r": request.path,
+               "s": response.status_code, "d": round(duration * 1000, 2),
+               "i": capture_hash(client_ip()), "o": self._outcome(response)}
+        if request.path == "/hub":
+            rec["k"] = capture_hash(request.args.get("key", "").strip())
+        elif request.path in ("/submit", "/verify"):
+            rec["k"] = capture_hash((body.get("key") or "").strip())
+            rec["u"] = capture_hash((body.get("userId") or "").strip())
+        elif request.path == "/verify/batch":
+            items = request.get_json(silent=True)
+            items = items.get("items") if isinstance(items, dict) else items
+            rec["b"] = [[capture_hash((it.get("key") or "").strip()), capture_hash((it.get("userId") or "").strip())]
+                        for it in (items or [])[:VERIFY_BATCH_MAX] if isinstance(it, dict)]
+        elif request.path in ("/admin/generate", "/admin/jobs"):
+            rec["n"] = body.get("count")
+        line = json.dumps(rec, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._buf.append(line)
+            if len(self._buf) >= 200 or time.monotonic() - self._last_flush >= 1:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        data, self._buf = "".join(self._buf), []
+        self._last_flush = time.monotonic()
+        if not data:
+            return
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data.encode())
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"[Capture] write error: {e}")
+
+    @staticmethod
+    def _outcome(response):
+        if response.status_code >= 500 and response.status_code != 503:
+            return "error"
+        if response.is_streamed or response.content_length and response.content_length > 4096:
+            return "ok" if response.status_code < 400 else "fail"
+        text = response.get_data(as_text=True)
+        if response.is_json:
+            data = response.get_json(silent=True) or {}
+            if "results" in data:
+                return "ok"
+            if data.get("success"):
+                return "ok"
+            text = data.get("message", "")
+        elif response.status_code < 400:
+            return "ok"
+        for needle, code in CAPTURE_OUTCOMES:
+            if needle in text:
+                return code
+        return "fail"
+
+capture = None
+if TRAFFIC_CAPTURE_FILE and not TRAFFIC_CAPTURE_SALT:
+    print("[Capture] TRAFFIC_CAPTURE_FILE ignored: set TRAFFIC_CAPTURE_SALT to a secret value")
+elif TRAFFIC_CAPTURE_FILE:
+    capture = TrafficCapture(TRAFFIC_CAPTURE_FILE)
+    atexit.register(capture.flush)
+
+@app.after_request
+def capture_traffic(response):
+    if capture and "trace_start" in g and (request.path in ("/hub", "/submit", "/verify", "/verify/batch")
+                                           or request.path.startswith("/admin/")):
+        capture.record(response, g.trace_wall, time.perf_counter() - g.trace_start)
+    return response
+
 # ── Key storage helpers ───────────────────────────────────────────────────────
 def use_db():
     return bool(DATABASE_URL)
 
-def load_key(key):
-    """Load a single key's data. Returns dict or None."""
+def _iso_fields(d):
+    """Normalize datetimes to ISO strings for compatibility."""
+    for f in ("activated_at", "expires_at", "locked_user_at", "created_at", "updated_at"):
+        if d.get(f) and hasattr(d[f], "isoformat"):
+            d[f] = d[f].isoformat()
+    return d
+
+def _key_row(r):
+    """A keys-table row in the shape the rest of the app uses (string "key")."""
+    d = dict(r)
+    d["key"] = keycodec.decode(d.pop("key_id"))
+    return _iso_fields(d)
+
+def load_key(key, allow_stale=False):
+    """Load a single key's data. Returns dict or None.
+
+    Served from the key cache when enabled. With allow_stale, a database
+    failure falls back to this worker's key snapshot (read-only paths like
+    /hub and /verify), and so does every such call while db_breaker is
+    open. Snapshot rows are marked "stale": don't write them back.
+    """
+    hit, data = key_cache.get(key)
+    if hit:
+        return data
     if use_db():
+        snapshot.ensure_started()
+        invalidations.ensure_started()
+        if allow_stale and db_breaker.open and snapshot.loaded:
+            return snapshot.get(key)
+        try:
+            # The generation comes from whoever ran the query: a caller that
+            # joined a flight begun before an eviction must not cache its row.
+            gen, data = key_flight.do(key, lambda: _select_key_gen(key))
+            data = None if data is None else dict(data)
+        except Exception as e:
+            print(f"[DB] load_key error: {e}")
+            db_breaker.trip()
+            if allow_stale and snapshot.loaded:
+                return snapshot.get(key)
+            return None
+    else:
+        gen = key_cache.generation
+        with span("json_load"):
+            data = _read_keys_json().get(key)
+            data = None if data is None else dict(data)
+    key_cache.put(key, data, gen)
+    return data
+
+def _select_key_gen(key):
+    gen = key_cache.generation
+    return gen, _select_key(key)
+
+def _select_key(key):
+    import psycopg2.extras
+    conn = get_db()
+    cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with span("key_select"):
+        run_query(cur, "SELECT * FROM keys WHERE key_id = %s", (keycodec.encode(key),))
+        row = cur.fetchone()
+    cur.close(); conn.close()
+    return None if row is None else _key_row(row)
+
+def load_keys(keys, allow_stale=False):
+    """Load many keys in one query. Returns {key: data} for the ones found."""
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    if use_db():
+        if allow_stale and db_breaker.open and snapshot.loaded:
+            found = ((k, snapshot.get(k)) for k in keys)
+            return {k: d for k, d in found if d is not None}
         try:
             import psycopg2.extras
             conn = get_db()
             cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cur.execute("SELECT * FROM keys WHERE key = %s", (key,))
-            row = cur.fetchone()
+            with span("key_select"):
+                run_query(cur, "SELECT * FROM keys WHERE key_id = ANY(%s)", ([keycodec.encode(k) for k in keys],))
+                rows = [_key_row(r) for r in cur.fetchall()]
             cur.close(); conn.close()
-            if row is None:
-                return None
-            d = dict(row)
-            # Normalize datetimes to ISO strings for compatibility
-            for f in ("activated_at", "expires_at", "locked_user_at", "created_at"):
-                if d.get(f) and hasattr(d[f], "isoformat"):
-                    d[f] = d[f].isoformat()
-            return d
+            return {r["key"]: r for r in rows}
         except Exception as e:
-            print(f"[DB] load_key error: {e}")
-            return None
+            print(f"[DB] load_keys error: {e}")
+            db_breaker.trip()
+            if allow_stale and snapshot.loaded:
+                found = ((k, snapshot.get(k)) for k in keys)
+                return {k: d for k, d in found if d is not None}
+            return {}
+    with span("json_load"):
+        all_keys = _read_keys_json()
+    return {k: dict(all_keys[k]) for k in keys if k in all_keys}
+
+@traced("lock_keys")
+def lock_keys(claims):
+    """Lock each unclaimed key in {key: user_id} with one set-based update.
+
+    Returns {key: locked_user} for keys that were locked (or deleted) by
+    someone else in the meantime and therefore weren't claimed.
+    """
+    lost = {}
+    if use_db():
+        try:
+            conn = get_db()
+            cur  = conn.cursor()
+            with span("key_update"):
+                run_query(cur, """
+                    UPDATE keys SET
+                        locked_user    = v.user_id,
+                        locked_user_at = NOW(),
+                        updated_at     = NOW(),
+                        seq            = nextval('key_change_seq'),
+                        write_xid      = pg_current_xact_id()::text::bigint
+                    FROM unnest(%s::bigint[], %s::text[]) AS v(key_id, user_id)
+                    WHERE keys.key_id = v.key_id AND keys.locked_user IS NULL
+                    RETURNING keys.key_id
+                """, ([keycodec.encode(k) for k in claims], list(claims.values())))
+                locked = {keycodec.decode(r[0]) for r in cur.fetchall()}
+            missed = [k for k in claims if k not in locked]
+            if missed:
+                run_query(cur, "SELECT key_id, locked_user FROM keys WHERE key_id = ANY(%s)",
+                          ([keycodec.encode(k) for k in missed],))
+                lost = dict.fromkeys(missed)
+                lost.update((keycodec.decode(i), u) for i, u in cur.fetchall())
+            notify_keys(cur, list(locked))
+            with span("db_commit"):
+                conn.commit()
+            cur.close(); conn.close()
+        except Exception as e:
+            print(f"[DB] lock_keys error: {e}")
     else:
-        keys = _load_json()
-        return keys.get(key)
-
+        with local_lock:
+            keys = _load_json()
+            now  = datetime.now(timezone.utc).isoformat()
+            seqs = _next_local_seqs(len(claims))
+            for (key, user_id), seq in zip(claims.items(), seqs):
+                data = keys.get(key)
+                if data is None or data.get("locked_user"):
+                    lost[key] = data and data.get("locked_user")
+                    continue
+                data.update(locked_user=user_id, locked_user_at=now, updated_at=now, seq=seq)
+            _save_json(keys)
+    forget_keys(list(claims))
+    return lost
+
+def forget_keys(keys):
+    """Drop this worker's cached copies after a write to keys."""
+    key_cache.evict(keys)
+    stats_flight.forget("stats")
+
+def notify_keys(cur, keys, refresh=True):
+    """Queue an invalidation for keys; Postgres delivers it on commit.
+
+    With refresh=False listeners only evict their caches and leave the
+    snapshot to its next scheduled refresh (new, unactivated job keys).
+    """
+    # NOTIFY payloads are capped at 8000 bytes.
+    prefix = "" if refresh else "~"
+    chunk  = []
+    for key in keys:
+        chunk.append(key)
+        if sum(len(k) + 1 for k in chunk) > 7000:
+            run_query(cur, "SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, prefix + ",".join(chunk)))
+            chunk = []
+    if chunk:
+        run_query(cur, "SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, prefix + ",".join(chunk)))
+
+@traced("save_key")
 def save_key(key, data):
     """Save/update a single key's data."""
     if use_db():
         try:
             conn = get_db()
             cur  = conn.cursor()
-            cur.execute("""
-                INSERT INTO keys
-                    (key, tier, tier_label, days, activated, activated_at,
-                     expires_at, locked_user, locked_user_at, created_at)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                ON CONFLICT (key) DO UPDATE SET
-                    activated      = EXCLUDED.activated,
-                    activated_at   = EXCLUDED.activated_at,
-                    expires_at     = EXCLUDED.expires_at,
-                    locked_user    = EXCLUDED.locked_user,
-                    locked_user_at = EXCLUDED.locked_user_at
-            """, (
-                key,
-                data.get("tier"),
-                data.get("tier_label"),
-                data.get("days"),
-                data.get("activated", False),
-                data.get("activated_at"),
-                data.get("expires_at"),
-                data.get("locked_user"),
-                data.get("locked_user_at"),
-                data.get("created_at", datetime.now(timezone.utc).isoformat()),
-            ))
-            conn.commit()
+            with span("key_upsert"):
+                run_query(cur, """
+                    INSERT INTO keys
+                        (key_id, tier, tier_label, days, activated, activated_at,
+                         expires_at, locked_user, locked_user_at, created_at)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                    ON CONFLICT (key_id) DO UPDATE SET
+                        activated      = EXCLUDED.activated,
+                        activated_at   = EXCLUDED.activated_at,
+                        expires_at     = EXCLUDED.expires_at,
+                        locked_user    = EXCLUDED.locked_user,
+                        locked_user_at = EXCLUDED.locked_user_at,
+                        updated_at     = NOW(),
+                        seq            = nextval('key_change_seq'),
+                        write_xid      = pg_current_xact_id()::text::bigint
+                """, (
+                    keycodec.encode(key),
+                    data.get("tier"),
+                    data.get("tier_label"),
+                    data.get("days"),
+                    data.get("activated", False),
+                    data.get("activated_at"),
+                    data.get("expires_at"),
+                    data.get("locked_user"),
+                    data.get("locked_user_at"),
+                    data.get("created_at", datetime.now(timezone.utc).isoformat()),
+                ))
+            notify_keys(cur, [key])
+            with span("db_commit"):
+                conn.commit()
             cur.close(); conn.close()
         except Exception as e:
             print(f"[DB] save_key error: {e}")
     else:
-        keys = _load_json()
-        keys[key] = data
-        _save_json(keys)
+        with local_lock:
+            keys = _load_json()
+            data["updated_at"] = datetime.now(timezone.utc).isoformat()
+            data["seq"]        = _next_local_seq()
+            keys[key] = data
+            _save_json(keys)
+    forget_keys([key])
+
+def delete_key(key):
+    """Delete a key and record a tombstone for the change feed."""
+    if use_db():
+        conn = get_db()
+        cur  = conn.cursor()
+        key_id = keycodec.encode(key)
+        run_query(cur, "DELETE FROM keys WHERE key_id = %s RETURNING key_id", (key_id,))
+        if cur.fetchone() is not None:
+            run_query(cur, "INSERT INTO key_tombstones (key_id) VALUES (%s)", (key_id,))
+            notify_keys(cur, [key])
+        conn.commit(); cur.close(); conn.close()
+    else:
+        with local_lock:
+            keys = _load_json()
+            if key in keys:
+                del keys[key]
+                _save_json(keys)
+                state = _load_changes_json()
+                state["seq"] += 1
+                state["deleted"].append({"key": key, "seq": state["seq"],
+                                         "deleted_at": datetime.now(timezone.utc).isoformat()})
+                _save_changes_json(state)
+    forget_keys([key])
 
 def key_exists(key):
     if use_db():
         return load_key(key) is not None
-    return key in _load_json()
+    return key in _read_keys_json()
+
+# Local mode rewrites whole files: serialize read-modify-write within a worker,
+# and replace files atomically so concurrent readers never see half a file.
+local_lock = threading.RLock()
+
+def _write_atomic(path, obj, **kw):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f, **kw)
+    os.replace(tmp, path)
 
 def _load_json():
     if os.path.exists(KEYS_FILE):
@@ -144,11 +797,1364 @@ def _load_json():
             return json.load(f)
     return {}
 
+_keys_json = {"stamp": None, "keys": {}}
+
+def _read_keys_json():
+    """Parsed keys.json for read-only callers, reparsed only when the file changes.
+
+    The dict is shared: copy a record before changing it.
+    """
+    try:
+        st = os.stat(KEYS_FILE)
+    except FileNotFoundError:
+        return {}
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with local_lock:
+        if _keys_json["stamp"] != stamp:
+            _keys_json["keys"]  = _load_json()
+            _keys_json["stamp"] = stamp
+        return _keys_json["keys"]
+
 def _save_json(keys):
-    with open(KEYS_FILE, "w") as f:
-        json.dump(keys, f, indent=2)
+    _write_atomic(KEYS_FILE, keys, indent=2)
+
+def _load_changes_json():
+    if os.path.exists(CHANGES_FILE):
+        with open(CHANGES_FILE, "r") as f:
+            return json.load(f)
+    return {"seq": 0, "deleted": []}
+
+def _save_changes_json(state):
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat()
+    state["deleted"] = [t for t in state["deleted"] if t["deleted_at"] >= cutoff]
+    _write_atomic(CHANGES_FILE, state)
+
+def _next_local_seq():
+    return _next_local_seqs(1)[0]
+
+def _next_local_seqs(n):
+    with local_lock:
+        state = _load_changes_json()
+        first = state["seq"] + 1
+        state["seq"] += n
+        _save_changes_json(state)
+    return range(first, first + n)
+
+# ── Change feed ───────────────────────────────────────────────────────────────
+# In DB mode the cursor is a transaction id (write_xid), in local mode a seq.
+def read_horizon(conn):
+    """Newest transaction id whose writes have all settled.
+
+    Transaction ids are handed out when a writer starts, not when it commits,
+    so a lower one can still become visible after a higher one. Nothing below
+    the oldest transaction still running can, so readers stop just short of
+    it: a slow writer delays the feed but never blocks other writers.
+    """
+    cur = conn.cursor()
+    run_query(cur, "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint - 1")
+    horizon = cur.fetchone()[0]
+    cur.close()
+    return horizon
+
+def current_cursor():
+    """Cursor covering every write that has settled so far."""
+    if use_db():
+        conn = get_db()
+        horizon = read_horizon(conn)
+        conn.close()
+        return horizon
+    return _load_changes_json()["seq"]
+
+def _select_changes(cur, since, high, limit):
+    """Key rows and tombstones with since < write_xid <= high, at most limit of each."""
+    run_query(cur, """
+        SELECT * FROM keys
+        WHERE write_xid > %s AND write_xid <= %s AND (job_id IS NULL OR activated OR locked_user IS NOT NULL)
+        ORDER BY write_xid, seq LIMIT %s
+    """, (since, high, limit))
+    rows = [dict(_key_row(r), pos=r["write_xid"]) for r in cur.fetchall()]
+    run_query(cur, """
+        SELECT key_id, seq, write_xid FROM key_tombstones
+        WHERE write_xid > %s AND write_xid <= %s ORDER BY write_xid, seq LIMIT %s
+    """, (since, high, limit))
+    dead = [{"key": keycodec.decode(r["key_id"]), "seq": r["seq"], "pos": r["write_xid"]} for r in cur.fetchall()]
+    return rows, dead
+
+def _change_list(rows, dead, now):
+    """[(cursor position, change)] sorted oldest first."""
+    changes = [(r["pos"], dict(key_summary(r, now), op="upsert", seq=r["seq"])) for r in rows]
+    changes += [(t["pos"], {"op": "delete", "key": t["key"], "seq": t["seq"]}) for t in dead]
+    changes.sort(key=lambda c: (c[0], c[1]["seq"]))
+    return changes
+
+def load_changes(since, limit=CHANGES_LIMIT):
+    """Return (changes, cursor, more) for writes after cursor since, oldest first.
+
+    Upserts carry the same row summary as /admin/keys, deletes only the key.
+    Only settled transactions are returned (read_horizon), and a page never
+    ends inside one, since the cursor can only point between them.
+
+    Keys made by a generation job are left out until a player touches them:
+    a 500k-key job would otherwise be a thousand pages for every open tab.
+    The tab that ran the job reloads /admin/keys instead. The cursor still
+    moves past them (to the horizon read first) once caught up.
+    """
+    now = datetime.now(timezone.utc)
+    if use_db():
+        import psycopg2.extras
+        conn = get_db()
+        high = read_horizon(conn)
+        cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            changes = _change_list(*_select_changes(cur, since, high, limit + 1), now)
+            if len(changes) > limit and changes[0][0] == changes[limit][0]:
+                # One transaction bigger than a page (a large lock_keys): send all of it.
+                xid = changes[0][0]
+                changes = _change_list(*_select_changes(cur, xid - 1, xid, None), now)
+                return [c for _, c in changes], xid, True
+        finally:
+            cur.close(); conn.close()
+    else:
+        with local_lock:
+            state = _load_changes_json()
+            keys  = _read_keys_json()
+        high = state["seq"]
+        rows = []
+        for k, v in keys.items():
+            if (v.get("seq") or 0) > since and not (v.get("job_id") and not v.get("activated")
+                                                    and not v.get("locked_user")):
+                rows.append(dict(v, key=k, pos=v["seq"]))
+        dead = [dict(t, pos=t["seq"]) for t in state["deleted"] if t["seq"] > since]
+        changes = _change_list(rows, dead, now)
+
+    more = len(changes) > limit
+    if more:
+        cut     = changes[limit][0]
+        changes = [c for c in changes[:limit] if c[0] < cut]
+        cursor  = cut - 1
+    else:
+        cursor = max(since, high)
+    return [c for _, c in changes], cursor, more
+
+# ── Key snapshot ──────────────────────────────────────────────────────────────
+# Only what /hub and /verify read.
+SNAPSHOT_FIELDS = ("tier", "tier_label", "activated", "expires_at", "locked_user")
+
+def ensure_worker_thread(owner, target, name):
+    """Start target once per process (gunicorn forks after import)."""
+    if owner._pid == os.getpid():
+        return
+    with owner._lock:
+        if owner._pid == os.getpid():
+            return
+        owner._pid = os.getpid()
+    threading.Thread(target=target, name=name, daemon=True).start()
+
+class KeySnapshot:
+    """Read-only, periodically refreshed copy of the keys table.
+
+    Columns are parallel arrays sorted by key id for bisect: ids (int64),
+    an index into a shared table of (tier, tier_label, activated) combos,
+    expires_at as epoch seconds (NaN for none) and locked_user (None for
+    most keys), about 26 bytes per key plus locked users' ids. After one
+    bulk scan, refreshes only pull rows and tombstones written after cursor
+    (a transaction id, as in load_changes).
+    A handful of changes is inserted in place; larger deltas (a job chunk
+    is thousands of rows) are merged into fresh arrays in one pass.
+    """
+
+    MERGE_THRESHOLD = 64
+
+    def __init__(self, refresh_seconds, full_seconds):
+        self.refresh_seconds = refresh_seconds
+        self.full_seconds    = full_seconds
+        self.cursor          = 0
+        self.refresh_errors  = 0
+        self.served          = 0
+        self._ids       = array.array("q")
+        self._kinds     = array.array("H")
+        self._expires   = array.array("d")
+        self._users     = []
+        self._kind_table = []  # index -> (tier, tier_label, activated), interned
+        self._kind_index = {}
+        self._loaded_at = None  # monotonic time of last successful refresh
+        self._full_at   = None
+        self._lock = threading.Lock()
+        self._pid  = None
+        self._wake = threading.Event()
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def ensure_started(self):
+        if self.refresh_seconds > 0:
+            ensure_worker_thread(self, self._run, "key-snapshot")
+
+    def get(self, key):
+        key_id = keycodec.parse(key)
+        if key_id is None:
+            return None
+        with self._lock:
+            i = bisect.bisect_left(self._ids, key_id)
+            if i == len(self._ids) or self._ids[i] != key_id:
+                return None
+            kind, expires, user = self._kinds[i], self._expires[i], self._users[i]
+        tier, tier_label, activated = self._kind_table[kind]
+        self.served += 1
+        return {"key": key, "tier": tier, "tier_label": tier_label, "activated": activated,
+                "expires_at": None if math.isnan(expires) else datetime.fromtimestamp(expires, timezone.utc).isoformat(),
+                "locked_user": user, "stale": True}
+
+    def age(self):
+        return None if self._loaded_at is None else time.monotonic() - self._loaded_at
+
+    def poke(self):
+        """Refresh early (a write was announced on the invalidation channel)."""
+        self._wake.set()
+
+    def stats(self):
+        age = self.age()
+        return {"loaded": self.loaded, "size": len(self._ids), "cursor": self.cursor,
+                "age_seconds": None if age is None else round(age, 1),
+                "refresh_errors": self.refresh_errors, "served_stale": self.served}
+
+    def refresh(self):
+        cols = ", ".join(SNAPSHOT_FIELDS)
+        conn = get_db()
+        cur  = conn.cursor()
+        try:
+            full = self._full_at is None or time.monotonic() - self._full_at >= self.full_seconds
+            if full:
+                # Cursor first: rows written during the scan are re-applied later.
+                cursor = read_horizon(conn)
+                run_query(cur, f"SELECT key_id, {cols} FROM keys ORDER BY key_id")
+                ids, kinds, expires, users = array.array("q"), array.array("H"), array.array("d"), []
+                for r in cur:
+                    kind, exp, user = self._pack(r[1:])
+                    ids.append(r[0]); kinds.append(kind); expires.append(exp); users.append(user)
+                with self._lock:
+                    self._ids, self._kinds, self._expires, self._users = ids, kinds, expires, users
+                    self.cursor = cursor
+                self._full_at = time.monotonic()
+            else:
+                high = read_horizon(conn)
+                run_query(cur, f"SELECT seq, key_id, {cols} FROM keys WHERE write_xid > %s AND write_xid <= %s",
+                          (self.cursor, high))
+                changes = [(r[0], r[1], self._pack(r[2:])) for r in cur.fetchall()]
+                run_query(cur, "SELECT seq, key_id FROM key_tombstones WHERE write_xid > %s AND write_xid <= %s",
+                          (self.cursor, high))
+                changes += [(seq, key_id, None) for seq, key_id in cur.fetchall()]
+                changes.sort(key=lambda c: c[0])  # seq: a key's writes in order
+                cursor = max(self.cursor, high)
+                if len(changes) > self.MERGE_THRESHOLD:
+                    merged = self._merge({key_id: row for _, key_id, row in changes})
+                    with self._lock:
+                        self._ids, self._kinds, self._expires, self._users = merged
+                        self.cursor = cursor
+                else:
+                    with self._lock:
+                        for _, key_id, row in changes:
+                            self._apply(key_id, row)
+                        self.cursor = cursor
+            self._loaded_at = time.monotonic()
+        finally:
+            cur.close(); conn.close()
+
+    def _pack(self, values):
+        """(kind, expires, locked_user) for a row in SNAPSHOT_FIELDS order."""
+        tier, tier_label, activated, expires_at, locked_user = values
+        combo = (sys.intern(tier), sys.intern(tier_label), bool(activated))
+        kind  = self._kind_index.get(combo)
+        if kind is None:
+            kind = self._kind_index[combo] = len(self._kind_table)
+            self._kind_table.append(combo)
+        return kind, expires_at.timestamp() if expires_at else math.nan, locked_user
+
+    def _apply(self, key_id, row):
+        i = bisect.bisect_left(self._ids, key_id)
+        present = i < len(self._ids) and self._ids[i] == key_id
+        columns = (self._kinds, self._expires, self._users)
+        if row is None:
+            if present:
+                del self._ids[i]
+                for col in columns:
+                    del col[i]
+        elif present:
+            for col, v in zip(columns, row):
+                col[i] = v
+        else:
+            self._ids.insert(i, key_id)
+            for col, v in zip(columns, row):
+                col.insert(i, v)
+
+    def _merge(self, latest):
+        """New arrays with latest ({key_id: row or None}) applied.
+
+        Only the refresh thread writes the arrays, so reading them here
+        without the lock is safe; unchanged runs are copied by slice.
+        """
+        ids, kinds, expires, users = array.array("q"), array.array("H"), array.array("d"), []
+        old = (self._ids, self._kinds, self._expires, self._users)
+        pos = 0
+        for key_id in sorted(latest):
+            i = bisect.bisect_left(self._ids, key_id, pos)
+            for new, col in zip((ids, kinds, expires, users), old):
+                new.extend(col[pos:i])
+            pos = i + 1 if i < len(self._ids) and self._ids[i] == key_id else i
+            row = latest[key_id]
+            if row is not None:
+                ids.append(key_id)
+                kind, exp, user = row
+                kinds.append(kind); expires.append(exp); users.append(user)
+        for new, col in zip((ids, kinds, expires, users), old):
+            new.extend(col[pos:])
+        return ids, kinds, expires, users
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+                db_breaker.reset()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"[Snapshot] refresh error: {e}")
+            time.sleep(1)  # coalesce bursts of pokes
+            self._wake.wait(self.refresh_seconds)
+            self._wake.clear()
+
+snapshot = KeySnapshot(SNAPSHOT_REFRESH_SECONDS, SNAPSHOT_FULL_SECONDS)
+
+class CircuitBreaker:
+    """Opens for open_seconds after a failure; a successful snapshot refresh
+    closes it early. When it expires the next call tries the database again.
+    """
+
+    def __init__(self, open_seconds):
+        self.open_seconds = open_seconds
+        self.trips  = 0
+        self._until = 0
+
+    @property
+    def open(self):
+        return time.monotonic() < self._until
+
+    def trip(self):
+        if not self.open:
+            self.trips += 1
+        self._until = time.monotonic() + self.open_seconds
+
+    def reset(self):
+        self._until = 0
+
+    def stats(self):
+        return {"open": self.open, "trips": self.trips, "open_seconds": self.open_seconds}
+
+db_breaker = CircuitBreaker(DB_BREAKER_SECONDS)
+
+# ── Key cache and invalidation ────────────────────────────────────────────────
+class KeyCache:
+    """Per-worker LRU of load_key results, including misses, with a TTL.
+
+    Entries are evicted by invalidation messages from other workers. A load
+    that raced with an invalidation isn't stored (generation check). In local
+    mode any change to keys.json (size/mtime) clears the whole cache, which
+    also covers generate_keys.py and manual edits.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl        = ttl
+        self.size       = size
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+        self._data = collections.OrderedDict()  # key -> (expires, data)
+        self._lock = threading.Lock()
+        self._file_token = None
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _check_local(self):
+        try:
+            st = os.stat(KEYS_FILE)
+            token = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            token = None
+        if token != self._file_token:
+            self._file_token = token
+            self.clear()
+
+    def get(self, key):
+        if not self.enabled:
+            return False, None
+        if not use_db():
+            self._check_local()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return True, None if entry[1] is None else dict(entry[1])
+
+    def put(self, key, data, gen):
+        if not self.enabled:
+            return
+        with self._lock:
+            if gen != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, None if data is None else dict(data))
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def evict(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.evictions += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        return {"enabled": self.enabled, "size": len(self._data), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+key_cache = KeyCache(KEY_CACHE_TTL, KEY_CACHE_SIZE)
+
+class InvalidationListener:
+    """LISTENs on the invalidation channel and evicts announced keys.
+
+    Payloads are comma-separated keys; "*" clears everything. Each one also
+    wakes the snapshot refresh unless it starts with "~". After losing
+    the connection the whole cache is dropped, since notifications sent
+    while disconnected are gone.
+    """
+
+    def __init__(self, channel):
+        self.channel   = channel
+        self.received  = 0
+        self.errors    = 0
+        self.connected = False
+        self._lock = threading.Lock()
+        self._pid  = None
+
+    def ensure_started(self):
+        if key_cache.enabled or snapshot.refresh_seconds > 0:
+            ensure_worker_thread(self, self._run, "invalidation-listener")
+
+    def handle(self, payload):
+        self.received += 1
+        poke = not payload.startswith("~")
+        payload = payload.lstrip("~")
+        if payload == "*":
+            key_cache.clear()
+            stats_flight.forget("stats")
+        else:
+            forget_keys(payload.split(","))
+        if poke:
+            snapshot.poke()
+
+    def stats(self):
+        return {"connected": self.connected, "received": self.received, "errors": self.errors}
+
+    def _run(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                import psycopg2.extensions
+                conn = get_db()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                run_query(cur, f'LISTEN "{self.channel}"')
+                key_cache.clear()
+                self.connected, backoff = True, 1
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                self.errors += 1
+                print(f"[Invalidation] listener error: {e}")
+            finally:
+                self.connected = False
+                key_cache.clear()
+                if conn is not None:
+                    try: conn.close()
+                    except Exception: pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+invalidations = InvalidationListener(INVALIDATION_CHANNEL)
+
+# ── Event log ─────────────────────────────────────────────────────────────────
+EVENT_FIELDS = ("at", "kind", "key", "user_id", "ip", "route", "detail")
+
+class EventLog:
+    """Append-only audit log, buffered per worker and written in batches.
+
+    record() never touches storage: it appends to a bounded in-memory buffer
+    and a background thread flushes it with one multi-row INSERT (or one
+    append to events.jsonl locally). When the buffer is full new events are
+    dropped; drop counts are written as a "dropped" event on the next flush.
+    """
+
+    def __init__(self, capacity, flush_seconds):
+        self.capacity      = capacity
+        self.flush_seconds = flush_seconds
+        self.written       = 0
+        self.dropped       = 0
+        self._buf     = collections.deque()
+        self._lock    = threading.Lock()
+        self._drops   = collections.Counter()  # kind -> dropped since last flush
+        self._pid     = None
+        self._wake    = threading.Event()
+
+    def record(self, kind, key=None, user_id=None, detail=None):
+        ip = route = None
+        if has_request_context():
+            ip, route = valid_ip(client_ip()), request.path
+        ev = (datetime.now(timezone.utc), kind, (key or None) and key[:64],
+              (user_id or None) and user_id[:64], ip, route, detail)
+        with self._lock:
+            if len(self._buf) >= self.capacity:
+                self.dropped += 1
+                self._drops[kind] += 1
+                return
+            self._buf.append(ev)
+        self._ensure_thread()
+
+    def stats(self):
+        return {"buffered": len(self._buf), "written": self.written, "dropped": self.dropped}
+
+    def flush(self):
+        with self._lock:
+            batch = list(self._buf)
+            self._buf.clear()
+            drops, self._drops = self._drops, collections.Counter()
+        if drops:
+            batch.append((datetime.now(timezone.utc), "dropped", None, None, None, None,
+                          json.dumps(dict(drops))))
+        if not batch:
+            return
+        try:
+            if use_db():
+                import psycopg2.extras
+                conn = get_db()
+                cur  = conn.cursor()
+                sql = "INSERT INTO events (at, kind, key, user_id, ip, route, detail) VALUES %s"
+                with querylog.timed(cur, sql, [batch], explain=False):
+                    psycopg2.extras.execute_values(cur, sql, batch, page_size=1000)
+                conn.commit(); cur.close(); conn.close()
+            else:
+                # One O_APPEND write per batch so workers' lines never interleave.
+                data = "".join(json.dumps(dict(zip(EVENT_FIELDS, (ev[0].isoformat(),) + ev[1:]))) + "\n"
+                               for ev in batch)
+                fd = os.open(EVENTS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    os.write(fd, data.encode())
+                finally:
+                    os.close(fd)
+            self.written += len(batch)
+        except Exception as e:
+            # Storage is down: the batch is lost rather than retried so the
+            # buffer can't grow without bound; the loss is counted.
+            self.dropped += len(batch)
+            print(f"[Events] flush error ({len(batch)} events dropped): {e}")
+
+    def _ensure_thread(self):
+        ensure_worker_thread(self, self._run, "event-log")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+events = EventLog(EVENT_BUFFER_SIZE, EVENT_FLUSH_SECONDS)
+atexit.register(events.flush)
+
+def load_events(kind=None, key=None, before=None, limit=100):
+    """Most recent events first, optionally filtered by kind/key."""
+    if use_db():
+        import psycopg2.extras
+        where, params = [], []
+        if kind:   where.append("kind = %s"); params.append(kind)
+        if key:    where.append("key = %s");  params.append(key)
+        if before: where.append("id < %s");   params.append(before)
+        sql = "SELECT * FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        conn = get_db()
+        cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        run_query(cur, sql + " ORDER BY id DESC LIMIT %s", params + [limit])
+        rows = [dict(r) for r in cur.fetchall()]
+        cur.close(); conn.close()
+        for r in rows:
+            r["at"] = r["at"].isoformat()
+        return rows
+    rows = []
+    if os.path.exists(EVENTS_FILE):
+        with open(EVENTS_FILE, "r") as f:
+            for i, line in enumerate(f, 1):
+                r = dict(json.loads(line), id=i)
+                if (kind and r["kind"] != kind) or (key and r["key"] != key) or (before and i >= before):
+                    continue
+                rows.append(r)
+    return rows[::-1][:limit]
+
+def event_rate(kind, minutes=60):
+    """Per-minute counts of one event kind over the last N minutes."""
+    if use_db():
+        conn = get_db()
+        cur  = conn.cursor()
+        run_query(cur, """
+            SELECT date_trunc('minute', at) AS minute, COUNT(*) FROM events
+            WHERE kind = %s AND at > NOW() - %s * INTERVAL '1 minute'
+            GROUP BY minute ORDER BY minute
+        """, (kind, minutes))
+        rows = [{"minute": m.isoformat(), "count": n} for m, n in cur.fetchall()]
+        cur.close(); conn.close()
+        return rows
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=minutes)).isoformat()
+    counts = collections.Counter()
+    for r in load_events(kind=kind, limit=None):
+        if r["at"] > cutoff:
+            counts[r["at"][:16]] += 1
+    return [{"minute": m, "count": n} for m, n in sorted(counts.items())]
+
+# ── Dashboard rollups ─────────────────────────────────────────────────────────
+ROLLUP_METRICS = ("generated", "activated", "expired", "locked")
+ROLLUP_UPSERT = """
+    INSERT INTO key_rollups (granularity, bucket, tier, generated, activated, expired, locked)
+    VALUES %s
+    ON CONFLICT (granularity, bucket, tier) DO UPDATE SET
+        generated = key_rollups.generated + EXCLUDED.generated,
+        activated = key_rollups.activated + EXCLUDED.activated,
+        expired   = key_rollups.expired   + EXCLUDED.expired,
+        locked    = key_rollups.locked    + EXCLUDED.locked
+"""
+
+def backfill_rollups(cur):
+    """One-time fill of key_rollups from the keys table (first worker wins)."""
+    run_query(cur, """
+        INSERT INTO rollup_state (name, watermark) VALUES ('expired', NOW())
+        ON CONFLICT (name) DO NOTHING RETURNING name
+    """)
+    if cur.fetchone() is None:
+        return
+    for metric, column in (("generated", "created_at"), ("activated", "activated_at"),
+                           ("expired", "expires_at"), ("locked", "locked_user_at")):
+        run_query(cur, f"""
+            INSERT INTO key_rollups (granularity, bucket, tier, {metric})
+            SELECT g.granularity, date_trunc(g.granularity, {column} AT TIME ZONE 'UTC'), tier, COUNT(*)
+            FROM keys, (VALUES ('hour'), ('day')) AS g(granularity)
+            WHERE {column} IS NOT NULL AND {column} <= NOW()
+            GROUP BY 1, 2, 3
+            ON CONFLICT (granularity, bucket, tier) DO UPDATE SET {metric} = EXCLUDED.{metric}
+        """)
+    print("[LegendLua] Rollups backfilled.")
+
+class Rollups:
+    """Hourly/daily per-tier counters for the dashboard charts.
+
+    Write paths bump in-memory counters; a background thread upserts them
+    as increments in one statement, then counts keys whose expires_at passed
+    since the shared watermark (expires_at is indexed, so this is a range
+    scan). Local mode computes the series straight from keys.json instead.
+    """
+
+    def __init__(self, flush_seconds):
+        self.flush_seconds = flush_seconds
+        self.flushes = 0
+        self.errors  = 0
+        self._counts = collections.Counter()  # (granularity, bucket, tier, metric) -> n
+        self._lock = threading.Lock()
+        self._pid  = None
+
+    def bump(self, metric, tier, n=1):
+        if not use_db():
+            return
+        hour = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+        day  = hour.replace(hour=0)
+        with self._lock:
+            self._counts[("hour", hour, tier, metric)] += n
+            self._counts[("day", day, tier, metric)]   += n
+        self.ensure_started()
+
+    def ensure_started(self):
+        # Also started at boot: the expired watermark advances with no writes.
+        if use_db():
+            ensure_worker_thread(self, self._run, "rollups")
+
+    def stats(self):
+        return {"pending": len(self._counts), "flushes": self.flushes, "errors": self.errors}
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        rows = collections.defaultdict(lambda: [0] * len(ROLLUP_METRICS))
+        for (gran, bucket, tier, metric), n in counts.items():
+            rows[(gran, bucket, tier)][ROLLUP_METRICS.index(metric)] += n
+        try:
+            import psycopg2.extras
+            conn = get_db()
+            cur  = conn.cursor()
+            if rows:
+                values = [k + tuple(v) for k, v in rows.items()]
+                with querylog.timed(cur, ROLLUP_UPSERT, [values], explain=False):
+                    psycopg2.extras.execute_values(cur, ROLLUP_UPSERT, values)
+            self._advance_expired(cur)
+            conn.commit(); cur.close(); conn.close()
+            self.flushes += 1
+        except Exception as e:
+            # Counters are tiny (buckets x tiers), so keep them for the next try.
+            self.errors += 1
+            with self._lock:
+                self._counts.update(counts)
+            print(f"[Rollups] flush error: {e}")
+
+    def _advance_expired(self, cur):
+        # SKIP LOCKED: only one worker at a time moves the watermark.
+        run_query(cur, "SELECT watermark, NOW() FROM rollup_state WHERE name = 'expired' FOR UPDATE SKIP LOCKED")
+        row = cur.fetchone()
+        if row is None:
+            return
+        watermark, now = row
+        run_query(cur, """
+            INSERT INTO key_rollups (granularity, bucket, tier, expired)
+            SELECT g.granularity, date_trunc(g.granularity, expires_at AT TIME ZONE 'UTC'), tier, COUNT(*)
+            FROM keys, (VALUES ('hour'), ('day')) AS g(granularity)
+            WHERE expires_at > %s AND expires_at <= %s
+            GROUP BY 1, 2, 3
+            ON CONFLICT (granularity, bucket, tier) DO UPDATE SET
+                expired = key_rollups.expired + EXCLUDED.expired
+        """, (watermark, now))
+        run_query(cur, "UPDATE rollup_state SET watermark = %s WHERE name = 'expired'", (now,))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+rollups = Rollups(ROLLUP_FLUSH_SECONDS)
+atexit.register(lambda: rollups._counts and rollups.flush())
+
+def load_series(granularity, since, tier=None):
+    """Rollup rows (oldest first) with bucket >= since (naive UTC)."""
+    if use_db():
+        import psycopg2.extras
+        sql, params = "SELECT * FROM key_rollups WHERE granularity = %s AND bucket >= %s", [granularity, since]
+        if tier:
+            sql += " AND tier = %s"; params.append(tier)
+        conn = get_db()
+        cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        run_query(cur, sql + " ORDER BY bucket, tier", params)
+        rows = [dict(r) for r in cur.fetchall()]
+        cur.close(); conn.close()
+    else:
+        now  = datetime.now(timezone.utc)
+        acc  = collections.defaultdict(lambda: dict.fromkeys(ROLLUP_METRICS, 0))
+        for v in _read_keys_json().values():
+            if tier and v.get("tier") != tier:
+                continue
+            for metric, field in (("generated", "created_at"), ("activated", "activated_at"),
+                                  ("expired", "expires_at"), ("locked", "locked_user_at")):
+                ts = v.get(field)
+                if not ts:
+                    continue
+                ts = datetime.fromisoformat(ts)
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                if ts > now:
+                    continue
+                ts = ts.astimezone(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+                if granularity == "day":
+                    ts = ts.replace(hour=0)
+                if ts >= since:
+                    acc[(ts, v.get("tier"))][metric] += 1
+        rows = [dict(m, granularity=granularity, bucket=b, tier=t) for (b, t), m in sorted(acc.items())]
+    for r in rows:
+        r["bucket"] = r["bucket"].isoformat()
+    return rows
+
+def load_upcoming_expiries(days):
+    """Keys expiring per day over the next N days (index range scan)."""
+    if use_db():
+        conn = get_db()
+        cur  = conn.cursor()
+        run_query(cur, """
+            SELECT date_trunc('day', expires_at AT TIME ZONE 'UTC') AS day, COUNT(*) FROM keys
+            WHERE expires_at > NOW() AND expires_at <= NOW() + %s * INTERVAL '1 day'
+            GROUP BY day ORDER BY day
+        """, (days,))
+        rows = [{"bucket": d.isoformat(), "count": n} for d, n in cur.fetchall()]
+        cur.close(); conn.close()
+        return rows
+    now, end = datetime.now(timezone.utc), datetime.now(timezone.utc) + timedelta(days=days)
+    counts = collections.Counter()
+    for v in _read_keys_json().values():
+        if v.get("expires_at"):
+            exp = datetime.fromisoformat(v["expires_at"])
+            if exp.tzinfo is None:
+                exp = exp.replace(tzinfo=timezone.utc)
+            if now < exp <= end:
+                counts[exp.astimezone(timezone.utc).strftime("%Y-%m-%dT00:00:00")] += 1
+    return [{"bucket": d, "count": n} for d, n in sorted(counts.items())]
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+class MemoryBucketStore:
+    """Token buckets in this worker only, LRU-bounded.
+
+    A bucket idle long enough to have refilled is the same as a new one, so
+    those are swept first; past max_buckets the least recently used go.
+    """
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._buckets = collections.OrderedDict()  # id -> (tokens, ts, full_after)
+        self._lock = threading.Lock()
+
+    def take(self, bucket_id, rate, burst, now):
+        with self._lock:
+            tokens, ts, _ = self._buckets.pop(bucket_id, (burst, now, 0))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[bucket_id] = (tokens, now, now + (burst - tokens) / rate)
+            while self._buckets:
+                oldest = next(iter(self._buckets.values()))
+                if oldest[2] > now and len(self._buckets) <= self.max_buckets:
+                    break
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def take_many(self, bucket_ids, rate, burst, now):
+        return [self.take(b, rate, burst, now) for b in bucket_ids]
+
+    def size(self):
+        return len(self._buckets)
+
+class SqliteBucketStore:
+    """Token buckets in a SQLite file, so all workers on a node share them.
+
+    Stands in for an external store like Redis; the file is scratch state
+    (no fsync). Each thread keeps its own connection.
+    """
+
+    def __init__(self, path, max_buckets):
+        self.path        = path
+        self.max_buckets = max_buckets
+        self._local = threading.local()
+        self._takes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                id TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL, full_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, bucket_id, rate, burst, now):
+        return self.take_many([bucket_id], rate, burst, now)[0]
+
+    def take_many(self, bucket_ids, rate, burst, now):
+        """One token from each bucket, in one transaction."""
+        conn = self._conn()
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for bucket_id in bucket_ids:
+                row = conn.execute("SELECT tokens, ts FROM buckets WHERE id = ?", (bucket_id,)).fetchone()
+                tokens, ts = row if row else (burst, now)
+                tokens = min(burst, tokens + (now - ts) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                conn.execute("INSERT OR REPLACE INTO buckets (id, tokens, ts, full_at) VALUES (?, ?, ?, ?)",
+                             (bucket_id, tokens, now, now + (burst - tokens) / rate))
+                results.append((allowed, 0 if allowed else (1 - tokens) / rate))
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    self._sweep(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def _sweep(self, conn, now):
+        conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+        excess = self.size(conn) - self.max_buckets
+        if excess > 0:
+            conn.execute("DELETE FROM buckets WHERE id IN (SELECT id FROM buckets ORDER BY ts LIMIT ?)", (excess,))
+
+    def size(self, conn=None):
+        return (conn or self._conn()).execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+class RateLimiter:
+    """Applies RATE_LIMITS; fails open (and counts it) if the store errors."""
+
+    def __init__(self, limits, store):
+        self.limits    = limits
+        self.store     = store
+        self.throttled = collections.Counter()  # "route:dim" -> n
+        self.errors    = 0
+
+    def check(self, route, ids):
+        """ids: {dim: value}. Returns seconds to wait, or 0 if allowed."""
+        wait = 0
+        now  = time.time()
+        for dim, value in ids.items():
+            rate, *burst = self.limits.get((route, dim), (0,))
+            if not rate or not value:
+                continue
+            try:
+                allowed, retry = self.store.take(f"{route}:{dim}:{value}", rate, burst[0], now)
+            except Exception as e:
+                self.errors += 1
+                print(f"[RateLimit] store error: {e}")
+                continue
+            if not allowed:
+                self.throttled[f"{route}:{dim}"] += 1
+                wait = max(wait, retry)
+        return wait
+
+    def check_many(self, route, dim, values):
+        """One token from the (route, dim) bucket of each value; returns the values refused."""
+        rate, *burst = self.limits.get((route, dim), (0,))
+        values = [v for v in values if v]
+        if not rate or not values:
+            return set()
+        try:
+            results = self.store.take_many([f"{route}:{dim}:{v}" for v in values], rate, burst[0], time.time())
+        except Exception as e:
+            self.errors += 1
+            print(f"[RateLimit] store error: {e}")
+            return set()
+        refused = {v for v, (allowed, _) in zip(values, results) if not allowed}
+        self.throttled[f"{route}:{dim}"] += len(refused)
+        return refused
+
+    def stats(self):
+        try:
+            size = self.store.size()
+        except Exception:
+            size = None
+        return {"store": type(self.store).__name__, "buckets": size,
+                "throttled": dict(self.throttled), "errors": self.errors}
+
+rate_limiter = RateLimiter(RATE_LIMITS, SqliteBucketStore(RATE_LIMIT_DB, RATE_LIMIT_MAX_BUCKETS)
+                           if RATE_LIMIT_STORE == "sqlite" else MemoryBucketStore(RATE_LIMIT_MAX_BUCKETS))
+
+@app.before_request
+def limit_rate():
+    # Runs before admission and before any storage access.
+    if request.path == "/hub":
+        route, key = "hub", request.args.get("key", "").strip()
+    elif request.path == "/verify":
+        route, key = "verify", ((request.get_json(silent=True) or {}).get("key") or "").strip()
+    elif request.path == "/verify/batch":
+        route, key = "verify_batch", None
+    else:
+        return None
+    # Lookups forgive case, spaces and dashes, so the bucket must too.
+    key = key and (keycodec.normalize(key) or key[:64])
+    with span("rate_limit"):
+        wait = rate_limiter.check(route, {"key": key or None, "ip": client_ip()})
+    if not wait:
+        return None
+    headers = {"Retry-After": str(max(1, math.ceil(wait)))}
+    if route == "hub":
+        return Response('error("[LegendLua] Too many requests, slow down.")',
+                        mimetype="text/plain", status=429, headers=headers)
+    return jsonify({"success": False, "message": "Too many requests, slow down."}), 429, headers
+
+# ── Admission control ─────────────────────────────────────────────────────────
+class AdmissionController:
+    """Bounded concurrency with priority classes and a bounded wait queue.
+
+    A request may run when a shared slot is free and its class is under its
+    own cap. While a higher-priority class is waiting for a slot it could use,
+    lower classes don't get it, so /verify is served before /hub and /admin.
+    """
+
+    def __init__(self, total, classes):
+        self.total    = total
+        self.classes  = classes  # name -> (priority, limit, queue)
+        self.running  = dict.fromkeys(classes, 0)
+        self.waiting  = dict.fromkeys(classes, 0)
+        self.admitted = dict.fromkeys(classes, 0)
+        self.rejected = dict.fromkeys(classes, 0)
+        self.peak_queue = dict.fromkeys(classes, 0)
+        self._cond = threading.Condition()
+
+    def _can_run(self, cls):
+        return sum(self.running.values()) < self.total and self.running[cls] < self.classes[cls][1]
+
+    def _outranked(self, cls):
+        prio = self.classes[cls][0]
+        return any(self.waiting[c] and self.classes[c][0] < prio and self._can_run(c)
+                   for c in self.classes)
+
+    def acquire(self, cls, timeout):
+        with self._cond:
+            if not (self._can_run(cls) and not self._outranked(cls)):
+                if self.waiting[cls] >= self.classes[cls][2]:
+                    self.rejected[cls] += 1
+                    return False
+                self.waiting[cls] += 1
+                self.peak_queue[cls] = max(self.peak_queue[cls], self.waiting[cls])
+                deadline = time.monotonic() + timeout
+                try:
+                    while not (self._can_run(cls) and not self._outranked(cls)):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected[cls] += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting[cls] -= 1
+            self.running[cls]  += 1
+            self.admitted[cls] += 1
+            return True
+
+    def release(self, cls):
+        with self._cond:
+            self.running[cls] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {cls: {"priority": p, "limit": lim, "queue_limit": q,
+                          "running": self.running[cls], "queued": self.waiting[cls],
+                          "peak_queued": self.peak_queue[cls],
+                          "admitted": self.admitted[cls], "rejected": self.rejected[cls]}
+                    for cls, (p, lim, q) in self.classes.items()}
+
+admission = AdmissionController(ADMIT_TOTAL, ADMIT_CLASSES)
+
+# Routes that never touch storage (or hold no slot while streaming) are exempt.
+ADMIT_EXEMPT = {"/admin", "/admin/metrics", "/admin/changes/stream"}
+
+def admission_class(path):
+    # Batches get their own, lower class so relays can't crowd out /verify.
+    if path == "/verify/batch":
+        return "verify_batch"
+    if path.startswith("/verify"):
+        return "verify"
+    if path in ("/hub", "/submit"):
+        return "hub"
+    if path.startswith("/admin") and path not in ADMIT_EXEMPT:
+        return "admin"
+    return None
+
+@app.before_request
+def admit_request():
+    cls = admission_class(request.path)
+    if cls is None:
+        return None
+    with span("admit"):
+        admitted = admission.acquire(cls, ADMIT_WAIT_SECONDS)
+    if not admitted:
+        headers = {"Retry-After": str(ADMIT_RETRY_AFTER)}
+        if cls == "hub" and request.path == "/hub":
+            return Response('error("[LegendLua] Server busy, try again shortly.")',
+                            mimetype="text/plain", status=503, headers=headers)
+        return jsonify({"success": False, "message": "Server busy, try again shortly."}), 503, headers
+    g.admitted = cls
+
+@app.teardown_request
+def release_admission(exc):
+    cls = g.pop("admitted", None)
+    if cls is not None:
+        admission.release(cls)
+
+# ── Generation jobs ───────────────────────────────────────────────────────────
+class GenJobs:
+    """Background generation of large key batches.
+
+    Queued jobs live in storage, not in the accepting worker: every worker
+    runs GEN_JOB_THREADS daemon threads that claim the oldest queued job
+    (FOR UPDATE SKIP LOCKED, so each goes to one thread), which means a job
+    outlives a restart of the worker that took the request. Each chunk of
+    keys is inserted and counted in one transaction, so progress survives
+    in storage and any worker can report it or serve the download.
+    """
+
+    def __init__(self, threads, chunk, poll_seconds):
+        self.threads      = threads
+        self.chunk        = chunk
+        self.poll_seconds = poll_seconds
+        self._wake   = threading.Event()
+        self._lock   = threading.Lock()
+        self._pid    = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.threads):
+                threading.Thread(target=self._run, name=f"gen-job-{i}", daemon=True).start()
+
+    def start(self, tier, count):
+        """Record a queued job and hand it to this worker's pool."""
+        now = datetime.now(timezone.utc).isoformat()
+        job = {"id": os.urandom(8).hex(), "tier": tier, "requested": count, "done": 0,
+               "state": "queued", "error": None, "created_at": now,
+               "started_at": None, "finished_at": None, "updated_at": now}
+        if use_db():
+            conn = get_db()
+            cur  = conn.cursor()
+            run_query(cur, "INSERT INTO gen_jobs (id, tier, requested) VALUES (%s, %s, %s)",
+                      (job["id"], tier, count))
+            conn.commit(); cur.close(); conn.close()
+        else:
+            with local_lock:
+                jobs = _load_local_jobs()
+                jobs[job["id"]] = job
+                _write_atomic(GEN_JOBS_FILE, jobs)
+        self.ensure_started()
+        self._wake.set()
+        return job
+
+    def get(self, job_id):
+        if use_db():
+            rows = self._select("SELECT * FROM gen_jobs WHERE id = %s", (job_id,))
+            return rows[0] if rows else None
+        return _load_local_jobs().get(job_id)
+
+    def recent(self, limit=20):
+        if use_db():
+            return self._select("SELECT * FROM gen_jobs ORDER BY created_at DESC LIMIT %s", (limit,))
+        jobs = sorted(_load_local_jobs().values(), key=lambda j: j["created_at"], reverse=True)
+        return jobs[:limit]
+
+    @staticmethod
+    def _select(sql, params):
+        import psycopg2.extras
+        conn = get_db()
+        cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        run_query(cur, sql, params)
+        rows = [GenJobs._row(r) for r in cur.fetchall()]
+        cur.close(); conn.close()
+        return rows
+
+    @staticmethod
+    def _row(r):
+        r = _iso_fields(dict(r))
+        for f in ("started_at", "finished_at"):
+            if hasattr(r[f], "isoformat"):
+                r[f] = r[f].isoformat()
+        return r
+
+    def _set(self, job_id, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        if use_db():
+            conn = get_db()
+            cur  = conn.cursor()
+            sets = ", ".join(f"{f} = %s" for f in fields)
+            run_query(cur, f"UPDATE gen_jobs SET {sets} WHERE id = %s", (*fields.values(), job_id))
+            conn.commit(); cur.close(); conn.close()
+        else:
+            with local_lock:
+                jobs = _load_local_jobs()
+                jobs[job_id].update(fields)
+                _write_atomic(GEN_JOBS_FILE, jobs)
+
+    def _claim(self):
+        """Mark the oldest queued or stalled job running and return it, or None.
+
+        A job still 'running' with no progress for GEN_JOB_STALL_SECONDS lost
+        its worker; claiming it bumps updated_at so only one thread resumes it.
+        """
+        now = datetime.now(timezone.utc)
+        if use_db():
+            import psycopg2.extras
+            conn = get_db()
+            cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            run_query(cur, """
+                UPDATE gen_jobs SET state = 'running', started_at = COALESCE(started_at, NOW()),
+                                    updated_at = NOW()
+                WHERE id = (SELECT id FROM gen_jobs
+                            WHERE state = 'queued'
+                               OR (state = 'running' AND updated_at < NOW() - %s * INTERVAL '1 second')
+                            ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED)
+                RETURNING *
+            """, (GEN_JOB_STALL_SECONDS,))
+            row = cur.fetchone()
+            conn.commit(); cur.close(); conn.close()
+            return None if row is None else self._row(row)
+        stale = (now - timedelta(seconds=GEN_JOB_STALL_SECONDS)).isoformat()
+        now   = now.isoformat()
+        with local_lock:
+            jobs  = _load_local_jobs()
+            ready = [j for j in jobs.values() if j["state"] == "queued"
+                     or (j["state"] == "running" and (j.get("updated_at") or "") < stale)]
+            if not ready:
+                return None
+            job = min(ready, key=lambda j: j["created_at"])
+            job.update(state="running", started_at=job.get("started_at") or now, updated_at=now)
+            _write_atomic(GEN_JOBS_FILE, jobs)
+        return dict(job)
+
+    def _run(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"[GenJob] claim error: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            job_id = job["id"]
+            try:
+                self._generate(job)
+            except Exception as e:
+                print(f"[GenJob] {job_id} failed: {e}")
+                try:
+                    self._set(job_id, state="failed", error=str(e)[:500],
+                              finished_at=datetime.now(timezone.utc).isoformat())
+                except Exception as e2:
+                    print(f"[GenJob] {job_id} could not record failure: {e2}")
+
+    def _generate(self, job):
+        tier, done = job["tier"], job["done"]
+        if done:
+            print(f"[GenJob] {job['id']}: resuming stalled job at {done}/{job['requested']}")
+        else:
+            print(f"[GenJob] {job['id']}: generating {job['requested']} {tier} keys")
+        while done < job["requested"]:
+            n = min(self.chunk, job["requested"] - done)
+            keys = self._insert_chunk_db(job["id"], tier, n) if use_db() else self._insert_chunk_local(job["id"], tier, n)
+            done += len(keys)
+            forget_keys(keys)
+            rollups.bump("generated", tier, len(keys))
+        self._set(job["id"], state="done", finished_at=datetime.now(timezone.utc).isoformat())
+        events.record("admin_generate", detail=json.dumps({"tier": tier, "count": done, "job": job["id"]}))
+        print(f"[GenJob] {job['id']}: done")
+
+    @staticmethod
+    def _insert_chunk_db(job_id, tier, n):
+        """Insert n new keys and bump the job's progress in one transaction."""
+        import psycopg2.extras
+        sql = """
+            INSERT INTO keys (key_id, tier, tier_label, days, activated, job_id) VALUES %s
+            ON CONFLICT (key_id) DO NOTHING RETURNING key_id
+        """
+        conn = get_db()
+        cur  = conn.cursor()
+        try:
+            new = []
+            while len(new) < n:  # a collision just means drawing again
+                ids    = {random.randrange(keycodec.KEY_SPACE) for _ in range(n - len(new))}
+                values = [(i, tier, TIERS[tier]["label"], TIERS[tier]["days"], job_id) for i in ids]
+                with querylog.timed(cur, sql, [values], explain=False):
+                    new += psycopg2.extras.execute_values(cur, sql, values, template="(%s,%s,%s,%s,FALSE,%s)",
+                                                          page_size=1000, fetch=True)
+            keys = [keycodec.decode(r[0]) for r in new]
+            notify_keys(cur, keys, refresh=False)
+            run_query(cur, "UPDATE gen_jobs SET done = done + %s, updated_at = NOW() WHERE id = %s",
+                      (len(keys), job_id))
+            conn.commit()
+            return keys
+        finally:
+            cur.close(); conn.close()
+
+    def _insert_chunk_local(self, job_id, tier, n):
+        now = datetime.now(timezone.utc).isoformat()
+        with local_lock:
+            keys = _load_json()
+            new  = []
+            for seq in _next_local_seqs(n):
+                key = keycodec.random_key()
+                while key in keys:
+                    key = keycodec.random_key()
+                keys[key] = {"tier": tier, "tier_label": TIERS[tier]["label"], "days": TIERS[tier]["days"],
+                             "activated": False, "activated_at": None, "expires_at": None,
+                             "locked_user": None, "locked_user_at": None, "created_at": now,
+                             "updated_at": now, "seq": seq, "job_id": job_id}
+                new.append(key)
+            _save_json(keys)
+            jobs = _load_local_jobs()
+            jobs[job_id]["done"] += len(new)
+            jobs[job_id]["updated_at"] = now
+            _write_atomic(GEN_JOBS_FILE, jobs)
+        return new
+
+    def stream_keys(self, job_id):
+        """The job's keys, one per line, in blocks (server-side cursor in DB mode)."""
+        if use_db():
+            conn = get_db()
+            try:
+                cur = conn.cursor(name=f"gen_job_{job_id}")
+                cur.itersize = 10000
+                run_query(cur, "SELECT key_id FROM keys WHERE job_id = %s ORDER BY key_id", (job_id,))
+                block = []
+                for (key_id,) in cur:
+                    block.append(keycodec.decode(key_id))
+                    if len(block) >= 10000:
+                        yield "\n".join(block) + "\n"
+                        block = []
+                if block:
+                    yield "\n".join(block) + "\n"
+                cur.close()
+            finally:
+                conn.close()
+        else:
+            keys = sorted(k for k, v in _read_keys_json().items() if v.get("job_id") == job_id)
+            for i in range(0, len(keys), 10000):
+                yield "\n".join(keys[i:i + 10000]) + "\n"
+
+def _load_local_jobs():
+    if os.path.exists(GEN_JOBS_FILE):
+        with open(GEN_JOBS_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+def job_status(job):
+    """Job record plus progress, throughput and ETA for the status endpoint."""
+    now = datetime.now(timezone.utc)
+    out = dict(job)
+    ts  = {f: datetime.fromisoformat(job[f]) if job.get(f) else None
+           for f in ("started_at", "finished_at", "updated_at")}
+    if out["state"] == "running" and ts["updated_at"] \
+            and (now - ts["updated_at"]).total_seconds() > GEN_JOB_STALL_SECONDS:
+        out["state"] = "stalled"
+    elapsed = ((ts["finished_at"] or now) - ts["started_at"]).total_seconds() if ts["started_at"] else 0
+    rate    = job["done"] / elapsed if elapsed > 0 else 0
+    out["percent"]         = round(100 * job["done"] / job["requested"], 1) if job["requested"] else 100
+    out["elapsed_seconds"] = round(elapsed, 1)
+    out["keys_per_second"] = round(rate, 1)
+    out["eta_seconds"]     = round((job["requested"] - job["done"]) / rate, 1) \
+                             if rate and out["state"] == "running" else None
+    return out
+
+gen_jobs = GenJobs(GEN_JOB_THREADS, GEN_JOB_CHUNK, GEN_JOB_POLL_SECONDS)
 
 # ── Expiry helper ─────────────────────────────────────────────────────────────
+@traced("check_expiry")
 def check_expiry(key_data):
     if key_data["tier"] == "lifetime":
         return True, "Lifetime"
@@ -171,19 +2177,79 @@ def check_expiry(key_data):
         return True, f"{days}d {hours}h remaining"
     return True, f"{hours}h remaining"
 
+def key_summary(r, now):
+    """Row shape used by the admin key table (and change feed)."""
+    if r.get("tier") == "lifetime":
+        status  = "Lifetime"
+        expires = "Never"
+    elif not r.get("activated"):
+        status  = "Unused"
+        expires = None
+    else:
+        exp = r.get("expires_at")
+        if exp:
+            if isinstance(exp, str):
+                exp = datetime.fromisoformat(exp)
+            if exp.tzinfo is None:
+                exp = exp.replace(tzinfo=timezone.utc)
+            status  = "Expired" if now > exp else "Active"
+            expires = exp.strftime("%Y-%m-%d")
+        else:
+            status  = "Active"
+            expires = None
+
+    return {
+        "key":         r.get("key",""),
+        "tier_label":  r.get("tier_label",""),
+        "status":      status,
+        "expires":     expires,
+        "locked_user": r.get("locked_user"),
+    }
+
 def get_base_url():
     scheme = request.headers.get("X-Forwarded-Proto", "http")
     return f"{scheme}://{request.host}"
 
+def valid_ip(text):
+    """Canonical form of an IP address, or None for anything else."""
+    try:
+        return str(ipaddress.ip_address((text or "").strip()))
+    except ValueError:
+        return None
+
+def client_ip():
+    # Railway's proxy appends the address it saw; earlier entries are whatever
+    # the client sent, so only the last PROXY_HOPS-th entry can be trusted.
+    if PROXY_HOPS:
+        hops = [h for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        if len(hops) >= PROXY_HOPS:
+            return valid_ip(hops[-PROXY_HOPS]) or request.remote_addr
+    return request.remote_addr
+
 # ── Lua loader ────────────────────────────────────────────────────────────────
+LUA_KEY_LINE = b'local KEY = "KEY_HERE"'
+_lua_parts   = {"stamp": None, "parts": None}
+
+def _lua_template():
+    """(before, placeholder, after) as UTF-8 bytes, re-read when the file changes."""
+    st = os.stat(LUA_FILE)
+    stamp = (st.st_mtime_ns, st.st_size)
+    if _lua_parts["stamp"] != stamp:
+        with open(LUA_FILE, "rb") as f:
+            _lua_parts["parts"] = f.read().partition(LUA_KEY_LINE)
+        _lua_parts["stamp"] = stamp
+    return _lua_parts["parts"]
+
+@traced("build_lua")
 def build_lua(key, tier_label, expires_str):
+    """The hub script for key as bytes: one join of the cached template parts."""
     if not os.path.exists(LUA_FILE):
         return f'error("[LegendLua] Script file missing on server.")'
-    with open(LUA_FILE, "r", encoding="utf-8") as f:
-        lua = f.read()
-    header = f"-- LegendLua Hub | Key: {key} | Tier: {tier_label} | Expires: {expires_str}\n"
-    lua = lua.replace('local KEY = "KEY_HERE"', f'local KEY = "{key}"', 1)
-    return header + lua
+    before, placeholder, after = _lua_template()
+    header = f"-- LegendLua Hub | Key: {key} | Tier: {tier_label} | Expires: {expires_str}\n".encode()
+    if not placeholder:
+        return header + before
+    return b"".join((header, before, f'local KEY = "{key}"'.encode(), after))
 
 # ── HTML ──────────────────────────────────────────────────────────────────────
 HTML = r"""<!DOCTYPE html>
@@ -320,10 +2386,12 @@ def index():
 @app.route("/submit", methods=["POST"])
 def submit():
     data = request.get_json()
-    key  = (data.get("key") or "").strip()
+    raw  = (data.get("key") or "").strip()
+    key  = keycodec.normalize(raw)
 
-    key_data = load_key(key)
+    key_data = load_key(key) if key else None
     if key_data is None:
+        events.record("unknown_key", raw)
         return jsonify({"success": False, "message": "Key not found. Please check and try again."})
 
     # Activate on first use — start the expiry timer NOW
@@ -335,9 +2403,12 @@ def submit():
         else:
             key_data["expires_at"] = None
         save_key(key, key_data)
+        events.record("activation", key, detail=key_data["tier"])
+        rollups.bump("activated", key_data["tier"])
 
     valid, expires_status = check_expiry(key_data)
     if not valid:
+        events.record("expired_hit", key)
         return jsonify({"success": False, "message": f"This key has expired ({key_data['tier_label']} tier)."})
 
     base = get_base_url()
@@ -352,21 +2423,51 @@ def submit():
 
 @app.route("/hub", methods=["GET"])
 def hub():
-    key = request.args.get("key", "").strip()
-    if not key:
+    raw = request.args.get("key", "").strip()
+    if not raw:
         return Response('error("[LegendLua] No key provided.")', mimetype="text/plain", status=403)
 
-    key_data = load_key(key)
+    key      = keycodec.normalize(raw)
+    key_data = load_key(key, allow_stale=True) if key else None
     if key_data is None:
+        events.record("unknown_key", raw)
         return Response('error("[LegendLua] Invalid key. Get one at the LegendLua portal.")', mimetype="text/plain", status=403)
 
     valid, expires_status = check_expiry(key_data)
     if not valid:
+        events.record("expired_hit", key)
         return Response(f'error("[LegendLua] Key expired ({key_data["tier_label"]} tier).")', mimetype="text/plain", status=403)
 
     expires_str = "Never (Lifetime)" if key_data["tier"] == "lifetime" else (key_data.get("expires_at") or "")[:10]
     return Response(build_lua(key, key_data["tier_label"], expires_str), mimetype="text/plain")
 
+VERIFY_MISSING  = {"success": False, "message": "Missing key or userId."}
+VERIFY_UNKNOWN  = {"success": False, "message": "Key not found. Get a valid key at the portal."}
+VERIFY_CONFLICT = {"success": False, "message": "This key is already linked to another Roblox account."}
+VERIFY_THROTTLED = {"success": False, "message": "Too many requests, slow down."}
+
+def verify_outcome(key, user_id, key_data):
+    """Rules shared by /verify and /verify/batch.
+
+    Returns (result, lock): lock is True when the key is unclaimed and
+    should now be locked to user_id.
+    """
+    if key_data is None:
+        events.record("unknown_key", key, user_id)
+        return VERIFY_UNKNOWN, False
+
+    valid, expires_status = check_expiry(key_data)
+    if not valid:
+        events.record("expired_hit", key, user_id)
+        return {"success": False, "message": f"Your key has expired ({key_data['tier_label']} tier)."}, False
+
+    locked_user = key_data.get("locked_user")
+    if locked_user and locked_user != user_id:
+        events.record("lock_conflict", key, user_id, detail=locked_user)
+        return VERIFY_CONFLICT, False
+
+    return {"success": True, "tier": key_data["tier_label"], "expires": expires_status}, not locked_user
+
 @app.route("/verify", methods=["POST"])
 def verify():
     data    = request.get_json()
@@ -374,24 +2475,78 @@ def verify():
     user_id = (data.get("userId") or "").strip()
 
     if not key or not user_id:
-        return jsonify({"success": False, "message": "Missing key or userId."})
-
-    key_data = load_key(key)
-    if key_data is None:
-        return jsonify({"success": False, "message": "Key not found. Get a valid key at the portal."})
-
-    valid, expires_status = check_expiry(key_data)
-    if not valid:
-        return jsonify({"success": False, "message": f"Your key has expired ({key_data['tier_label']} tier)."})
+        return jsonify(VERIFY_MISSING)
 
-    if not key_data.get("locked_user"):
+    key      = keycodec.normalize(key) or key  # unknown keys are logged as typed
+    key_data = load_key(key, allow_stale=True) if keycodec.parse(key) is not None else None
+    result, lock = verify_outcome(key, user_id, key_data)
+    if lock and not key_data.get("stale"):  # the DB is down: don't wait on a write
         key_data["locked_user"]    = user_id
         key_data["locked_user_at"] = datetime.now(timezone.utc).isoformat()
         save_key(key, key_data)
-    elif key_data["locked_user"] != user_id:
-        return jsonify({"success": False, "message": "This key is already linked to another Roblox account."})
-
-    return jsonify({"success": True, "tier": key_data["tier_label"], "expires": expires_status})
+        events.record("user_lock", key, user_id)
+        rollups.bump("locked", key_data["tier"])
+
+    return jsonify(result)
+
+@app.route("/verify/batch", methods=["POST"])
+def verify_batch():
+    """Verify many {key, userId} pairs: one lookup query, one lock update.
+
+    Results come back in request order with the same shape as /verify.
+    Within a batch the first pair to claim an unlocked key wins it.
+    """
+    data  = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"success": False, "message": "Expected a list of {key, userId} pairs."})
+    if len(items) > VERIFY_BATCH_MAX:
+        return jsonify({"success": False, "message": f"At most {VERIFY_BATCH_MAX} pairs per batch."})
+
+    pairs = []
+    for it in items:
+        it = it if isinstance(it, dict) else {}
+        key = (it.get("key") or "").strip()
+        pairs.append((keycodec.normalize(key) or key, (it.get("userId") or "").strip()))
+
+    # Each key pays into the same bucket as a single /verify, once per batch,
+    # so batching doesn't get around the per-key limit.
+    lookup = {k for k, u in pairs if u and keycodec.parse(k) is not None}
+    with span("rate_limit"):
+        throttled = rate_limiter.check_many("verify", "key", lookup)
+    records = load_keys(lookup - throttled, allow_stale=True)
+    results = []
+    claims  = {}  # key -> user_id locked by this batch
+    for key, user_id in pairs:
+        if not key or not user_id:
+            results.append(VERIFY_MISSING)
+            continue
+        if key in throttled:
+            results.append(VERIFY_THROTTLED)
+            continue
+        key_data = records.get(key)
+        if key_data is not None and key in claims:
+            key_data = dict(key_data, locked_user=claims[key])
+        result, lock = verify_outcome(key, user_id, key_data)
+        if lock and not key_data.get("stale"):
+            claims[key] = user_id
+        results.append(result)
+
+    if claims:
+        lost = lock_keys(claims)
+        for i, (key, user_id) in enumerate(pairs):
+            if key in lost and results[i]["success"] and lost[key] != user_id:
+                if lost[key] is None:
+                    results[i] = VERIFY_UNKNOWN
+                else:
+                    events.record("lock_conflict", key, user_id, detail=lost[key])
+                    results[i] = VERIFY_CONFLICT
+        for key, user_id in claims.items():
+            if key not in lost:
+                events.record("user_lock", key, user_id)
+                rollups.bump("locked", records[key]["tier"])
+
+    return jsonify({"success": True, "results": results})
 
 
 # ── Admin ─────────────────────────────────────────────────────────────────────
@@ -495,7 +2650,7 @@ ADMIN_HTML = r"""<!DOCTYPE html>
       <div class="row">
         <div class="field">
           <label>Amount</label>
-          <input type="number" id="countInput" value="1" min="1" max="100" style="margin-bottom:0"/>
+          <input type="number" id="countInput" value="1" min="1" style="margin-bottom:0"/>
         </div>
         <div class="field-sm">
           <button class="btn btn-primary" onclick="generateKeys()" style="margin-bottom:0">Generate</button>
@@ -510,6 +2665,7 @@ ADMIN_HTML = r"""<!DOCTYPE html>
     <div class="card">
       <div class="section-title">Overview</div>
       <div id="statsContent" style="color:var(--dim);font-size:.8rem;">Loading...</div>
+      <div id="seriesContent" style="margin-top:14px"></div>
     </div>
   </div>
 
@@ -530,11 +2686,38 @@ ADMIN_HTML = r"""<!DOCTYPE html>
       </table>
     </div>
   </div>
+
+  <!-- Event log card -->
+  <div class="card" style="max-width:860px;width:100%;margin-top:0;">
+    <div class="section-title">Event Log</div>
+    <div class="search-row">
+      <select id="eventKind" onchange="loadEvents()" style="margin-bottom:0;flex:1">
+        <option value="">All events</option>
+        <option value="activation">Activation</option>
+        <option value="user_lock">User lock</option>
+        <option value="lock_conflict">Lock conflict</option>
+        <option value="expired_hit">Expired hit</option>
+        <option value="unknown_key">Unknown key</option>
+        <option value="admin_generate">Admin generate</option>
+        <option value="admin_delete">Admin delete</option>
+        <option value="dropped">Dropped (buffer overflow)</option>
+      </select>
+      <button class="btn btn-danger" style="width:auto;padding:11px 18px" onclick="loadEvents()">Refresh</button>
+    </div>
+    <div id="eventsRate" style="color:var(--dim);font-size:.72rem;margin-bottom:8px"></div>
+    <div style="overflow-x:auto;">
+      <table class="keys-table">
+        <thead><tr><th>TIME</th><th>EVENT</th><th>KEY</th><th>USER</th><th>FROM</th></tr></thead>
+        <tbody id="eventsBody"></tbody>
+      </table>
+    </div>
+  </div>
 </div>
 
 <script>
 let SESSION_PW = '';
 let ALL_KEYS = [];
+let CURSOR = 0;
 
 function doLogin() {
   const pw = document.getElementById('pwInput').value;
@@ -547,8 +2730,9 @@ function doLogin() {
       SESSION_PW = pw;
       document.getElementById('loginScreen').style.display = 'none';
       document.getElementById('mainScreen').style.display = 'flex';
-      loadKeys();
+      loadKeys().then(streamChanges);
       loadStats();
+      loadEvents();
     } else {
       document.getElementById('loginErr').style.display = 'block';
     }
@@ -570,6 +2754,9 @@ async function generateKeys() {
   st.className = 'success'; st.style.display = 'block';
   out.style.display = 'none'; copyBtn.style.display = 'none';
 
+  // Big batches run as a background job: poll progress, then offer the file.
+  if (count > 100) return runGenJob(tier, count);
+
   const res  = await fetch('/admin/generate', {
     method: 'POST',
     headers: authHeaders(),
@@ -586,7 +2773,42 @@ async function generateKeys() {
   out.innerHTML  = data.keys.join('<br/>');
   out.style.display = 'block';
   copyBtn.style.display = 'block';
-  loadKeys(); loadStats();
+  pollChanges();
+  loadStats();
+}
+
+async function runGenJob(tier, count) {
+  const st  = document.getElementById('genStatus');
+  const res = await fetch('/admin/jobs', {method: 'POST', headers: authHeaders(), body: JSON.stringify({tier, count})});
+  let data  = await res.json();
+  if (!data.success) { st.textContent = data.message; st.className = 'error'; return; }
+  let job = data.job;
+  while (job.state === 'queued' || job.state === 'running') {
+    const eta = job.eta_seconds != null ? `, ~${Math.ceil(job.eta_seconds)}s left` : '';
+    st.textContent = `Job ${job.id}: ${job.done}/${job.requested} (${job.percent}%, ${job.keys_per_second} keys/s${eta})`;
+    await new Promise(r => setTimeout(r, 1000));
+    data = await (await fetch(`/admin/jobs/${job.id}`, {headers: authHeaders()})).json();
+    if (!data.success) { st.textContent = data.message; st.className = 'error'; return; }
+    job = data.job;
+  }
+  if (job.state !== 'done') {
+    st.textContent = `Job ${job.id} ${job.state}${job.error ? ': ' + job.error : ''} (${job.done}/${job.requested} generated)`;
+    st.className = 'error'; return;
+  }
+  st.innerHTML = `Generated ${job.done} key(s) in ${job.elapsed_seconds}s. <a href="#" onclick="downloadJob('${job.id}');return false" style="color:var(--accent)">Download</a>`;
+  // Job keys aren't in the change feed: one reload instead of replaying it.
+  loadKeys();
+  loadStats();
+}
+
+async function downloadJob(id) {
+  const res = await fetch(`/admin/jobs/${id}/keys`, {headers: authHeaders()});
+  if (!res.ok) return;
+  const url = URL.createObjectURL(await res.blob());
+  const a   = document.createElement('a');
+  a.href = url; a.download = `legendlua-${id}.txt`;
+  a.click();
+  URL.revokeObjectURL(url);
 }
 
 function copyAll() {
@@ -621,6 +2843,33 @@ async function loadStats() {
         <div style="font-family:'Orbitron',sans-serif;font-size:1.4rem;color:var(--danger)">${s.expired}</div>
       </div>
     </div>`;
+  loadSeries();
+}
+
+async function loadSeries() {
+  const res  = await fetch('/admin/series?granularity=day&n=14', {headers: authHeaders()});
+  const data = await res.json();
+  if (!data.success) return;
+  const days = {};
+  for (let i = 0; i < 14; i++) {
+    const d = new Date(Date.parse(data.since + 'Z') + i * 86400000).toISOString().slice(0, 10);
+    days[d] = {activated: 0, generated: 0};
+  }
+  data.series.forEach(r => {
+    const d = days[r.bucket.slice(0, 10)];
+    if (d) { d.activated += r.activated; d.generated += r.generated; }
+  });
+  const max  = Math.max(1, ...Object.values(days).map(d => Math.max(d.activated, d.generated)));
+  const bars = Object.entries(days).map(([day, d]) => `
+    <div title="${day}: ${d.activated} activated / ${d.generated} generated" style="flex:1;display:flex;align-items:flex-end;gap:1px;height:60px">
+      <div style="flex:1;background:var(--accent2);height:${100 * d.generated / max}%"></div>
+      <div style="flex:1;background:var(--success);height:${100 * d.activated / max}%"></div>
+    </div>`).join('');
+  const soon = data.upcoming.reduce((n, r) => n + r.count, 0);
+  document.getElementById('seriesContent').innerHTML = `
+    <div style="color:var(--dim);font-size:.65rem;letter-spacing:.15em;margin-bottom:6px">LAST 14 DAYS — GENERATED / ACTIVATED</div>
+    <div style="display:flex;gap:4px;background:#080e1a;border:1px solid var(--border);border-radius:8px;padding:10px">${bars}</div>
+    <div style="color:var(--dim);font-size:.7rem;margin-top:8px">${soon} key(s) expire in the next 14 days</div>`;
 }
 
 async function loadKeys() {
@@ -630,7 +2879,63 @@ async function loadKeys() {
   const data = await res.json();
   if (!data.success) { document.getElementById('keysLoading').textContent = 'Failed to load.'; return; }
   ALL_KEYS = data.keys;
-  renderKeys(ALL_KEYS);
+  CURSOR   = data.cursor;
+  filterKeys();
+}
+
+// Change feed: apply upserts/deletes since CURSOR instead of reloading the table.
+function applyChanges(data) {
+  if (!data.changes.length) return;
+  data.changes.forEach(c => {
+    const i = ALL_KEYS.findIndex(k => k.key === c.key);
+    if (c.op === 'delete') { if (i >= 0) ALL_KEYS.splice(i, 1); return; }
+    const row = {key: c.key, tier_label: c.tier_label, status: c.status, expires: c.expires, locked_user: c.locked_user};
+    if (i >= 0) ALL_KEYS[i] = row; else ALL_KEYS.unshift(row);
+  });
+  CURSOR = Math.max(CURSOR, data.cursor);
+  filterKeys();
+  scheduleStats();
+}
+
+// Player activity arrives every few seconds; refresh the stat cards (four
+// counts plus the series) at most every 30s for it. This tab's own
+// generate/delete refreshes them right away.
+let statsTimer = null;
+function scheduleStats() {
+  if (statsTimer) return;
+  statsTimer = setTimeout(() => { statsTimer = null; loadStats(); }, 30000);
+}
+
+async function pollChanges() {
+  const res  = await fetch(`/admin/changes?since=${CURSOR}`, {headers: authHeaders()});
+  const data = await res.json();
+  if (!data.success) return;
+  applyChanges(data);
+  if (data.more) pollChanges();
+}
+
+// fetch() rather than EventSource so the admin password stays in a header.
+async function streamChanges() {
+  try {
+    const res    = await fetch(`/admin/changes/stream?since=${CURSOR}`, {headers: authHeaders()});
+    const reader = res.body.getReader();
+    const dec    = new TextDecoder();
+    let buf = '';
+    for (;;) {
+      const {value, done} = await reader.read();
+      if (done) break;
+      buf += dec.decode(value, {stream: true});
+      let cut;
+      while ((cut = buf.indexOf('\n\n')) >= 0) {
+        const msg = buf.slice(0, cut); buf = buf.slice(cut + 2);
+        const line = msg.split('\n').find(l => l.startsWith('data: '));
+        if (line && msg.includes('event: changes')) applyChanges(JSON.parse(line.slice(6)));
+      }
+    }
+    setTimeout(streamChanges, 1000);
+  } catch (e) {
+    setTimeout(streamChanges, 5000);
+  }
 }
 
 function renderKeys(keys) {
@@ -666,6 +2971,34 @@ function filterKeys() {
   ));
 }
 
+async function loadEvents() {
+  const kind = document.getElementById('eventKind').value;
+  const res  = await fetch(`/admin/events?limit=100${kind ? '&kind=' + kind : ''}`, {headers: authHeaders()});
+  const data = await res.json();
+  if (!data.success) return;
+  const tbody = document.getElementById('eventsBody');
+  tbody.innerHTML = '';
+  data.events.forEach(e => {
+    const tr = document.createElement('tr');
+    tr.innerHTML = `
+      <td style="color:var(--dim);font-size:.72rem">${e.at.slice(0, 19).replace('T', ' ')}</td>
+      <td>${e.kind}</td>
+      <td style="font-size:.72rem;color:#5a9abf"></td>
+      <td style="color:var(--dim);font-size:.72rem"></td>
+      <td style="color:var(--dim);font-size:.72rem"></td>`;
+    // Key, user and IP come from clients, so never render them as HTML.
+    tr.children[2].textContent = e.key || e.detail || '-';
+    tr.children[3].textContent = e.user_id || '-';
+    tr.children[4].textContent = e.ip || '-';
+    tbody.appendChild(tr);
+  });
+  const rate = data.per_minute || [];
+  const last = rate.length ? rate[rate.length - 1].count : 0;
+  document.getElementById('eventsRate').textContent = kind
+    ? `${rate.reduce((n, r) => n + r.count, 0)} in the last hour, ${last} in the latest minute`
+    : `buffered ${data.log.buffered} / written ${data.log.written} / dropped ${data.log.dropped} (this worker)`;
+}
+
 async function deleteKey(key) {
   if (!confirm(`Delete key ${key}?`)) return;
   const res  = await fetch('/admin/delete', {
@@ -673,7 +3006,7 @@ async function deleteKey(key) {
     body: JSON.stringify({key})
   });
   const data = await res.json();
-  if (data.success) { loadKeys(); loadStats(); }
+  if (data.success) { pollChanges(); loadStats(); }
   else alert(data.message);
 }
 </script>
@@ -685,11 +3018,6 @@ def check_admin(req):
     pw = req.headers.get("X-Admin-Password") or (req.get_json(silent=True) or {}).get("password", "")
     return pw == ADMIN_PASSWORD
 
-def admin_generate_key():
-    import random, string
-    def seg(): return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f"LegendLua-{seg()}-{seg()}-{seg()}"
-
 @app.route("/admin")
 def admin_page():
     return render_template_string(ADMIN_HTML)
@@ -718,11 +3046,11 @@ def admin_generate():
     new_keys   = []
 
     for _ in range(count):
-        key = admin_generate_key()
+        key = keycodec.random_key()
         # Make sure it doesn't already exist
         attempts = 0
         while key_exists(key) and attempts < 20:
-            key = admin_generate_key()
+            key = keycodec.random_key()
             attempts += 1
 
         key_data = {
@@ -734,92 +3062,161 @@ def admin_generate():
         save_key(key, key_data)
         new_keys.append(key)
 
+    events.record("admin_generate", detail=json.dumps({"tier": tier, "count": len(new_keys)}))
+    rollups.bump("generated", tier, len(new_keys))
     return jsonify({"success": True, "keys": new_keys, "tier": tier_label})
 
+@app.route("/admin/jobs", methods=["GET", "POST"])
+def admin_jobs():
+    """POST {tier, count} starts a background generation job; GET lists recent jobs."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+
+    try:
+        if request.method == "GET":
+            return jsonify({"success": True, "jobs": [job_status(j) for j in gen_jobs.recent()]})
+
+        data = request.get_json(silent=True) or {}
+        tier = data.get("tier", "1month")
+        try:
+            count = int(data.get("count", 0))
+        except (TypeError, ValueError):
+            count = 0
+        if tier not in TIERS:
+            return jsonify({"success": False, "message": "Invalid tier."})
+        if not 1 <= count <= GEN_JOB_MAX:
+            return jsonify({"success": False, "message": f"Count must be between 1 and {GEN_JOB_MAX}."})
+        job = gen_jobs.start(tier, count)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "job": job_status(job)}), 202
+
+@app.route("/admin/jobs/<job_id>", methods=["GET"])
+def admin_job_status(job_id):
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+    try:
+        job = gen_jobs.get(job_id)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, "job": job_status(job)})
+
+@app.route("/admin/jobs/<job_id>/keys", methods=["GET"])
+def admin_job_keys(job_id):
+    """Stream a finished job's keys as a text file, one key per line."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+    try:
+        job = gen_jobs.get(job_id)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    if job["state"] != "done":
+        return jsonify({"success": False, "message": "Job not finished yet."}), 409
+    return Response(gen_jobs.stream_keys(job_id), mimetype="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="legendlua-{job["tier"]}-{job_id}.txt"'})
+
 @app.route("/admin/keys", methods=["GET"])
 def admin_list_keys():
     if not check_admin(request):
         return jsonify({"success": False, "message": "Unauthorized."}), 401
 
-    rows = []
+    # Rows go straight to their summaries; no intermediate list of full rows.
+    now = datetime.now(timezone.utc)
     if use_db():
         try:
             import psycopg2.extras
+            # Read the cursor first: anything written during the scan is
+            # re-delivered by /admin/changes, and applying it twice is harmless.
+            cursor = current_cursor()
             conn = get_db()
             cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cur.execute("SELECT * FROM keys ORDER BY created_at DESC")
-            raw = cur.fetchall()
+            run_query(cur, "SELECT key_id, tier, tier_label, activated, expires_at, locked_user "
+                           "FROM keys ORDER BY created_at DESC")
+            result = [key_summary(_key_row(r), now) for r in cur]
             cur.close(); conn.close()
-            for r in raw:
-                r = dict(r)
-                for f in ("activated_at","expires_at","locked_user_at","created_at"):
-                    if r.get(f) and hasattr(r[f], "isoformat"):
-                        r[f] = r[f].isoformat()
-                rows.append(r)
         except Exception as e:
             return jsonify({"success": False, "message": str(e)})
     else:
-        keys = _load_json()
-        for k, v in keys.items():
-            v["key"] = k
-            rows.append(v)
+        cursor = current_cursor()
+        result = [key_summary(dict(v, key=k), now) for k, v in _read_keys_json().items()]
 
-    # Build response list with status
-    result = []
-    now = datetime.now(timezone.utc)
-    for r in rows:
-        if r.get("tier") == "lifetime":
-            status  = "Lifetime"
-            expires = "Never"
-        elif not r.get("activated"):
-            status  = "Unused"
-            expires = None
-        else:
-            exp = r.get("expires_at")
-            if exp:
-                if isinstance(exp, str):
-                    exp = datetime.fromisoformat(exp)
-                if exp.tzinfo is None:
-                    exp = exp.replace(tzinfo=timezone.utc)
-                status  = "Expired" if now > exp else "Active"
-                expires = exp.strftime("%Y-%m-%d")
-            else:
-                status  = "Active"
-                expires = None
+    return jsonify({"success": True, "keys": result, "cursor": cursor})
+
+@app.route("/admin/changes", methods=["GET"])
+def admin_changes():
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
 
-        result.append({
-            "key":         r.get("key",""),
-            "tier_label":  r.get("tier_label",""),
-            "status":      status,
-            "expires":     expires,
-            "locked_user": r.get("locked_user"),
-        })
+    since = request.args.get("since", 0, type=int)
+    try:
+        changes, cursor, more = load_changes(since)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "changes": changes, "cursor": cursor, "more": more})
+
+@app.route("/admin/changes/stream", methods=["GET"])
+def admin_changes_stream():
+    """Server-sent events: pushes change batches until the stream times out."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
 
-    return jsonify({"success": True, "keys": result})
+    since = request.args.get("since", 0, type=int)
+
+    def events(cursor):
+        deadline  = time.monotonic() + CHANGES_STREAM_SECONDS
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            try:
+                changes, cursor_new, more = load_changes(cursor)
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+                return
+            if changes:
+                cursor = cursor_new
+                payload = {"changes": changes, "cursor": cursor, "more": more}
+                yield f"id: {cursor}\nevent: changes\ndata: {json.dumps(payload)}\n\n"
+                last_sent = time.monotonic()
+                if more:
+                    continue
+            elif time.monotonic() - last_sent >= 10:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(CHANGES_POLL_SECONDS)
+
+    return Response(events(since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/admin/stats", methods=["GET"])
 def admin_stats():
     if not check_admin(request):
         return jsonify({"success": False, "message": "Unauthorized."}), 401
 
+    try:
+        stats = stats_flight.do("stats", compute_key_stats, ttl=STATS_CACHE_SECONDS)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "stats": stats})
+
+def compute_key_stats():
     now = datetime.now(timezone.utc)
     total = active = unused = expired = 0
 
     if use_db():
-        try:
-            conn = get_db()
-            cur  = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM keys"); total = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM keys WHERE activated = FALSE"); unused = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM keys WHERE tier = 'lifetime'"); lifetime = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM keys WHERE activated = TRUE AND tier != 'lifetime' AND expires_at > NOW()"); active = cur.fetchone()[0]
-            active += lifetime
-            expired = total - unused - active
-            cur.close(); conn.close()
-        except Exception as e:
-            return jsonify({"success": False, "message": str(e)})
+        conn = get_db()
+        cur  = conn.cursor()
+        run_query(cur, "SELECT COUNT(*) FROM keys"); total = cur.fetchone()[0]
+        run_query(cur, "SELECT COUNT(*) FROM keys WHERE activated = FALSE"); unused = cur.fetchone()[0]
+        run_query(cur, "SELECT COUNT(*) FROM keys WHERE tier = 'lifetime'"); lifetime = cur.fetchone()[0]
+        run_query(cur, "SELECT COUNT(*) FROM keys WHERE activated = TRUE AND tier != 'lifetime' AND expires_at > NOW()"); active = cur.fetchone()[0]
+        active += lifetime
+        expired = total - unused - active
+        cur.close(); conn.close()
     else:
-        keys = _load_json()
+        keys = _read_keys_json()
         total = len(keys)
         for v in keys.values():
             if not v.get("activated"):
@@ -834,9 +3231,33 @@ def admin_stats():
                     if now > exp_dt: expired += 1
                     else: active += 1
 
-    return jsonify({"success": True, "stats": {
-        "total": total, "active": active, "unused": unused, "expired": max(0,expired)
-    }})
+    return {"total": total, "active": active, "unused": unused, "expired": max(0,expired)}
+
+@app.route("/admin/series", methods=["GET"])
+def admin_series():
+    """Activity time series from the rollup tables."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("hour", "day"):
+        return jsonify({"success": False, "message": "granularity must be hour or day."})
+    tier = request.args.get("tier") or None
+    if tier and tier not in TIERS:
+        return jsonify({"success": False, "message": "Invalid tier."})
+    span_n = min(request.args.get("n", 48 if granularity == "hour" else 30, type=int), 24 * 90)
+    step   = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    since  = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        since = since.replace(hour=0)
+    since -= step * (span_n - 1)
+    try:
+        series   = load_series(granularity, since, tier)
+        upcoming = load_upcoming_expiries(request.args.get("upcoming_days", 14, type=int))
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "granularity": granularity, "since": since.isoformat(),
+                    "series": series, "upcoming": upcoming})
 
 @app.route("/admin/delete", methods=["POST"])
 def admin_delete():
@@ -846,27 +3267,76 @@ def admin_delete():
     key = (request.get_json().get("key") or "").strip()
     if not key:
         return jsonify({"success": False, "message": "No key provided."})
+    if keycodec.parse(key) is None:
+        return jsonify({"success": False, "message": "Invalid key."})
+    key = keycodec.normalize(key)
 
-    if use_db():
-        try:
-            conn = get_db()
-            cur  = conn.cursor()
-            cur.execute("DELETE FROM keys WHERE key = %s", (key,))
-            conn.commit(); cur.close(); conn.close()
-        except Exception as e:
-            return jsonify({"success": False, "message": str(e)})
-    else:
-        keys = _load_json()
-        if key in keys:
-            del keys[key]
-            _save_json(keys)
+    try:
+        delete_key(key)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
 
+    events.record("admin_delete", key)
     return jsonify({"success": True})
 
+@app.route("/admin/metrics", methods=["GET"])
+def admin_metrics():
+    """Per-worker runtime counters (this process only)."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+
+    return jsonify({"success": True, "pid": os.getpid(), "metrics": {
+        "admission": admission.stats(),
+        "events":    events.stats(),
+        "snapshot":  snapshot.stats(),
+        "db_breaker": db_breaker.stats(),
+        "key_cache": key_cache.stats(),
+        "invalidations": invalidations.stats(),
+        "rollups":   rollups.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "singleflight": {"load_key": key_flight.stats(), "admin_stats": stats_flight.stats()},
+    }})
+
+@app.route("/admin/queries", methods=["GET"])
+def admin_queries():
+    """Top statements by total time in this worker, with captured plans."""
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+
+    sort = request.args.get("sort", "total_ms")
+    if sort not in ("total_ms", "max_ms", "mean_ms", "calls", "slow"):
+        return jsonify({"success": False, "message": "Invalid sort."})
+    if request.args.get("reset") == "1":
+        querylog.stats.reset()
+    return jsonify({"success": True, "pid": os.getpid(), "slow_ms": querylog.SLOW_QUERY_MS,
+                    "queries": querylog.stats.top(request.args.get("limit", 20, type=int), sort)})
+
+@app.route("/admin/events", methods=["GET"])
+def admin_events():
+    if not check_admin(request):
+        return jsonify({"success": False, "message": "Unauthorized."}), 401
+
+    kind   = request.args.get("kind") or None
+    key    = (request.args.get("key") or "").strip() or None
+    key    = key and (keycodec.normalize(key) or key)  # events keep raw text for non-keys
+    before = request.args.get("before", type=int)
+    limit  = min(request.args.get("limit", 100, type=int), 1000)
+    try:
+        rows = load_events(kind, key, before, limit)
+        rate = event_rate(kind, request.args.get("minutes", 60, type=int)) if kind else None
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "events": rows, "per_minute": rate, "log": events.stats()})
+
 
 # ── Startup ───────────────────────────────────────────────────────────────────
 with app.app_context():
     init_db()
+    if use_db():
+        snapshot.ensure_started()
+        invalidations.ensure_started()
+        rollups.ensure_started()
+    gen_jobs.ensure_started()  # picks up jobs queued before a restart
 
 if __name__ == "__main__":
     print("=== LegendLua Key Portal ===")
@@ -0,0 +1,164 @@
+"""
+LegendLua Memory Budgets
+Measures, per route, the peak memory allocated while serving one request and
+the memory still held afterwards (tracemalloc), at several key-table sizes.
+Each route has a budget of a fixed part plus a per-key part; the run fails
+when any route exceeds it, so allocation regressions show up before deploy.
+
+Every size runs in a fresh process against a seeded keys.json in a temp
+DATA_DIR (local mode), with rate limits and the stats cache switched off so
+the handler itself is measured.
+
+Usage:
+  python check_memory_budgets.py
+  python check_memory_budgets.py --sizes 1000 30000 --runs 10
+Exit status is 1 when a budget is exceeded.
+"""
+
+import argparse, gc, json, os, shutil, subprocess, sys, tempfile, tracemalloc
+from datetime import datetime, timedelta, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+KB = 1024
+
+# route -> (peak fixed bytes, peak bytes per key, retained bytes)
+# Local-mode writes rewrite keys.json, so write routes scale with table size;
+# reads use the parsed-file cache and shouldn't.
+BUDGETS = {
+    "index":         (224 * KB,    0,   64 * KB),
+    "hub":           (128 * KB,    0,   64 * KB),
+    "submit":        (256 * KB, 1280,   64 * KB),
+    "verify":        (256 * KB, 1280,   64 * KB),
+    "verify_batch":  (512 * KB, 1280,   64 * KB),
+    "admin_keys":    (512 * KB,  768,   64 * KB),
+    "admin_stats":   ( 64 * KB,    0,   64 * KB),
+    "admin_changes": (384 * KB,  896,   64 * KB),
+    "admin_series":  (128 * KB,    4,   64 * KB),
+}
+
+BATCH_SIZE = 50
+
+# ── Child: one table size ─────────────────────────────────────────────────────
+def seed(data_dir, size):
+    now  = datetime.now(timezone.utc)
+    keys = {}
+    for i in range(size):
+        data = {"tier": "1month", "tier_label": "1 Month", "days": 30,
+                "activated": False, "activated_at": None, "expires_at": None,
+                "locked_user": None, "locked_user_at": None,
+                "created_at": (now - timedelta(minutes=i)).isoformat(), "seq": i + 1}
+        if i % 2:
+            data.update(activated=True, activated_at=(now - timedelta(days=i % 40)).isoformat(),
+                        expires_at=(now + timedelta(days=30 - i % 40)).isoformat())
+        keys[f"LegendLua-MEM{i // 10**8 % 10}-{i // 10**4 % 10**4:04d}-{i % 10**4:04d}"] = data
+    with open(os.path.join(data_dir, "keys.json"), "w") as f:
+        json.dump(keys, f, indent=2)
+    with open(os.path.join(data_dir, "keys_changes.json"), "w") as f:
+        json.dump({"seq": size, "deleted": []}, f)
+    unused = [k for i, k in enumerate(keys) if not i % 2]
+    active = [k for i, k in enumerate(keys) if i % 2]
+    return unused, active
+
+def measure_one(client, method, path, body, headers):
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    resp = client.open(path, method=method, json=body, headers=headers)
+    resp.get_data()
+    resp.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    status = resp.status_code
+    del resp
+    gc.collect()
+    return status, peak - before, tracemalloc.get_traced_memory()[0] - before
+
+def run_size(size, runs):
+    sys.path.insert(0, SCRIPT_DIR)
+    unused, active = seed(os.environ["DATA_DIR"], size)
+    import app as A
+    client = A.app.test_client()
+    admin  = {"X-Admin-Password": A.ADMIN_PASSWORD}
+    unused, active = iter(unused), iter(active)
+
+    # route -> () -> (method, path, body, headers); submit/verify use fresh keys
+    scenarios = {
+        "index":         lambda: ("GET",  "/", None, None),
+        "hub":           lambda: ("GET",  f"/hub?key={next(active)}", None, None),
+        "submit":        lambda: ("POST", "/submit", {"key": next(unused)}, None),
+        "verify":        lambda: ("POST", "/verify", {"key": next(active), "userId": "mem-user"}, None),
+        "verify_batch":  lambda: ("POST", "/verify/batch", [{"key": next(active), "userId": f"mem-{i}"}
+                                                            for i in range(BATCH_SIZE)], None),
+        "admin_keys":    lambda: ("GET",  "/admin/keys", None, admin),
+        "admin_stats":   lambda: ("GET",  "/admin/stats", None, admin),
+        "admin_changes": lambda: ("GET",  "/admin/changes?since=0", None, admin),
+        "admin_series":  lambda: ("GET",  "/admin/series", None, admin),
+    }
+
+    tracemalloc.start()
+    results = {}
+    # Route by route so each one's first (warm-up) request absorbs cache fills.
+    for name in BUDGETS:
+        peaks, kept = [], []
+        for i in range(runs + 1):
+            status, peak, retained = measure_one(client, *scenarios[name]())
+            if status >= 400:
+                raise SystemExit(f"{name}: HTTP {status} at size {size}")
+            if i:
+                peaks.append(peak); kept.append(retained)
+        results[name] = {"peak": max(peaks), "retained": min(kept)}
+    tracemalloc.stop()
+    print(json.dumps(results))
+
+# ── Parent: all sizes, budgets, report ───────────────────────────────────────
+def measure_size(size, runs):
+    data_dir = tempfile.mkdtemp(prefix=f"legendlua-mem-{size}-")
+    env = dict(os.environ, DATA_DIR=data_dir, DATABASE_URL="",
+               RATE_LIMIT_STORE="memory", STATS_CACHE_SECONDS="0",
+               SNAPSHOT_REFRESH_SECONDS="0", TRACE_SAMPLE_RATE="0", TRACE_SLOW_MS="0",
+               RATE_HUB_KEY="0", RATE_HUB_IP="0", RATE_VERIFY_KEY="0", RATE_VERIFY_IP="0",
+               RATE_VERIFY_BATCH_IP="0")
+    env.pop("TRAFFIC_CAPTURE_FILE", None)
+    try:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(size), "--runs", str(runs)],
+                             env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if out.returncode != 0:
+        raise SystemExit(f"size {size} failed:\n{out.stdout}{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    p = argparse.ArgumentParser(description="Check per-route memory budgets.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    p.add_argument("--runs", type=int, default=5, help="measured requests per route (after one warm-up)")
+    p.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = p.parse_args()
+    if args.child is not None:
+        return run_size(args.child, args.runs)
+    # Every run's submit/verify/batch needs fresh keys; half the table is unused.
+    min_size = 2 * (args.runs + 1) * (BATCH_SIZE + 2)
+    if min(args.sizes) < min_size:
+        p.error(f"sizes must be at least {min_size} keys for {args.runs} runs")
+
+    print("=== LegendLua Memory Budgets ===\n")
+    print(f"  {'route':14} {'keys':>7} {'peak KB':>9} {'budget':>9} {'kept KB':>8} {'budget':>7}")
+    failed = []
+    for size in args.sizes:
+        results = measure_size(size, args.runs)
+        for name, (fixed, per_key, kept_budget) in BUDGETS.items():
+            r = results[name]
+            peak_budget = fixed + per_key * size
+            over = r["peak"] > peak_budget or r["retained"] > kept_budget
+            if over:
+                failed.append((name, size))
+            print(f"  {name:14} {size:>7} {r['peak'] / KB:>9.1f} {peak_budget / KB:>9.0f} "
+                  f"{r['retained'] / KB:>8.1f} {kept_budget / KB:>7.0f}{'  OVER' if over else ''}")
+        print()
+
+    if failed:
+        print(f"  FAILED: {', '.join(f'{n} @ {s} keys' for n, s in failed)}")
+        sys.exit(1)
+    print("  All routes within budget.")
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,16 @@ Usage:
   - On server: set DATABASE_URL env var, then python generate_keys.py
 """
 
-import json, random, string, os
+import json, os
 from datetime import datetime, timezone
+import keycodec
+from querylog import run_query
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 KEYS_FILE  = os.path.join(SCRIPT_DIR, "keys.json")
+CHANGES_FILE = os.path.join(SCRIPT_DIR, "keys_changes.json")  # app.py's change-feed counter
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
+INVALIDATION_CHANNEL = os.environ.get("INVALIDATION_CHANNEL", "legendlua_keys")
 
 TIERS = {
     "1day":    {"label": "1 Day",    "days": 1},
@@ -34,17 +38,14 @@ def get_db():
     url = DATABASE_URL.replace("postgres://", "postgresql://", 1)
     return psycopg2.connect(url)
 
-def generate_segment():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-
 def generate_key():
-    return f"LegendLua-{generate_segment()}-{generate_segment()}-{generate_segment()}"
+    return keycodec.random_key()
 
 def key_exists_db(key):
     try:
         conn = get_db()
         cur  = conn.cursor()
-        cur.execute("SELECT 1 FROM keys WHERE key = %s", (key,))
+        run_query(cur, "SELECT 1 FROM keys WHERE key_id = %s", (keycodec.encode(key),))
         exists = cur.fetchone() is not None
         cur.close(); conn.close()
         return exists
@@ -54,14 +55,33 @@ def key_exists_db(key):
 def save_key_db(key, tier, tier_label, days):
     conn = get_db()
     cur  = conn.cursor()
-    cur.execute("""
-        INSERT INTO keys (key, tier, tier_label, days, activated, created_at)
+    run_query(cur, """
+        INSERT INTO keys (key_id, tier, tier_label, days, activated, created_at)
         VALUES (%s, %s, %s, %s, FALSE, %s)
-        ON CONFLICT (key) DO NOTHING
-    """, (key, tier, tier_label, days, datetime.now(timezone.utc)))
+        ON CONFLICT (key_id) DO NOTHING
+    """, (keycodec.encode(key), tier, tier_label, days, datetime.now(timezone.utc)))
+    # Portal workers may have cached this key as missing.
+    run_query(cur, "SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, key))
     conn.commit()
     cur.close(); conn.close()
 
+def bump_rollups_db(tier, count):
+    """Count the new keys in the portal's dashboard rollups (if set up)."""
+    try:
+        conn = get_db()
+        cur  = conn.cursor()
+        run_query(cur, """
+            INSERT INTO key_rollups (granularity, bucket, tier, generated)
+            SELECT g.granularity, date_trunc(g.granularity, NOW() AT TIME ZONE 'UTC'), %s, %s
+            FROM (VALUES ('hour'), ('day')) AS g(granularity)
+            ON CONFLICT (granularity, bucket, tier) DO UPDATE SET
+                generated = key_rollups.generated + EXCLUDED.generated
+        """, (tier, count))
+        conn.commit()
+        cur.close(); conn.close()
+    except Exception as e:
+        print(f"  [WARN] Could not update rollups: {e}")
+
 def load_json():
     if os.path.exists(KEYS_FILE):
         with open(KEYS_FILE, "r") as f:
@@ -72,6 +92,16 @@ def save_json(keys):
     with open(KEYS_FILE, "w") as f:
         json.dump(keys, f, indent=2)
 
+def load_changes_json():
+    if os.path.exists(CHANGES_FILE):
+        with open(CHANGES_FILE, "r") as f:
+            return json.load(f)
+    return {"seq": 0, "deleted": []}
+
+def save_changes_json(state):
+    with open(CHANGES_FILE, "w") as f:
+        json.dump(state, f)
+
 def generate_keys(count, tier):
     if tier not in TIERS:
         print(f"[ERROR] Invalid tier. Choose from: {', '.join(TIERS.keys())}")
@@ -83,13 +113,14 @@ def generate_keys(count, tier):
 
     if use_db():
         print(f"  Saving to PostgreSQL database...")
-        # Make sure table exists
+        # Make sure table exists (app.py migrates tables with the old TEXT key)
         try:
             conn = get_db()
             cur  = conn.cursor()
-            cur.execute("""
+            run_query(cur, "CREATE SEQUENCE IF NOT EXISTS key_change_seq")
+            run_query(cur, """
                 CREATE TABLE IF NOT EXISTS keys (
-                    key             TEXT PRIMARY KEY,
+                    key_id          BIGINT PRIMARY KEY,
                     tier            TEXT NOT NULL,
                     tier_label      TEXT NOT NULL,
                     days            INTEGER,
@@ -98,7 +129,10 @@ def generate_keys(count, tier):
                     expires_at      TIMESTAMPTZ,
                     locked_user     TEXT,
                     locked_user_at  TIMESTAMPTZ,
-                    created_at      TIMESTAMPTZ DEFAULT NOW()
+                    created_at      TIMESTAMPTZ DEFAULT NOW(),
+                    updated_at      TIMESTAMPTZ DEFAULT NOW(),
+                    seq             BIGINT DEFAULT nextval('key_change_seq'),
+                    write_xid       BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint
                 )
             """)
             conn.commit()
@@ -113,21 +147,26 @@ def generate_keys(count, tier):
                 key = generate_key()
             save_key_db(key, tier, tier_label, days)
             new_keys.append(key)
+        bump_rollups_db(tier, len(new_keys))
     else:
         print(f"  Saving to keys.json (no DATABASE_URL set)...")
-        keys = load_json()
+        keys  = load_json()
+        state = load_changes_json()  # new keys get change-feed seqs like app.py writes
+        now   = datetime.now(timezone.utc).isoformat()
         for _ in range(count):
             key = generate_key()
             while key in keys:
                 key = generate_key()
+            state["seq"] += 1
             keys[key] = {
                 "tier": tier, "tier_label": tier_label, "days": days,
                 "activated": False, "activated_at": None,
                 "expires_at": None, "locked_user": None, "locked_user_at": None,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": now, "updated_at": now, "seq": state["seq"]
             }
             new_keys.append(key)
         save_json(keys)
+        save_changes_json(state)
 
     print(f"\n  Generated {count} {tier_label} key(s):\n")
     for k in new_keys:
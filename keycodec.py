@@ -0,0 +1,55 @@
+"""
+LegendLua Key Codec
+Canonical spelling of a license key and its compact integer form, shared by
+app.py and generate_keys.py. A key is "LegendLua-" plus three groups of four
+base-36 characters (0-9, A-Z); those 12 characters are a number below 36**12,
+which fits a signed 64-bit BIGINT, so PostgreSQL stores and indexes keys as
+key_id instead of 24-character strings.
+"""
+
+import random, re
+
+PREFIX    = "LegendLua-"
+ALPHABET  = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+KEY_SPACE = 36 ** 12  # < 2**63
+
+# After removing whitespace and upper-casing; prefix and dashes optional.
+_KEY = re.compile(r"(?:LEGENDLUA-?)?([0-9A-Z]{4})-?([0-9A-Z]{4})-?([0-9A-Z]{4})")
+_WS  = re.compile(r"\s+")
+
+def _match(text):
+    if not isinstance(text, str):
+        return None
+    return _KEY.fullmatch(_WS.sub("", text).upper())
+
+def parse(text):
+    """key_id for text, or None if it isn't a key (case/whitespace forgiven)."""
+    m = _match(text)
+    return None if m is None else int("".join(m.groups()), 36)
+
+def encode(key):
+    """key_id for a key; raises ValueError if it isn't one."""
+    key_id = parse(key)
+    if key_id is None:
+        raise ValueError(f"Not a LegendLua key: {key!r}")
+    return key_id
+
+def decode(key_id):
+    """Canonical 'LegendLua-XXXX-XXXX-XXXX' for a key_id."""
+    if not 0 <= key_id < KEY_SPACE:
+        raise ValueError(f"key_id out of range: {key_id}")
+    chars = []
+    for _ in range(12):
+        key_id, r = divmod(key_id, 36)
+        chars.append(ALPHABET[r])
+    c = "".join(reversed(chars))
+    return f"{PREFIX}{c[:4]}-{c[4:8]}-{c[8:]}"
+
+def normalize(text):
+    """Canonical spelling of text, or None if it isn't a key."""
+    key_id = parse(text)
+    return None if key_id is None else decode(key_id)
+
+def random_key():
+    """A new random key in canonical form."""
+    return decode(random.randrange(KEY_SPACE))
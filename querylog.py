@@ -0,0 +1,184 @@
+"""
+LegendLua Query Log
+Thin wrapper that every SQL statement in app.py and generate_keys.py goes
+through. Each statement is timed and aggregated per normalized SQL text;
+statements slower than SLOW_QUERY_MS are logged with their parameter shapes
+and row counts, and (with SLOW_QUERY_EXPLAIN=1) get a plan captured on a
+separate connection in the background: EXPLAIN (ANALYZE, BUFFERS) for plain
+reads, plain EXPLAIN for writes, which must not run twice.
+"""
+
+import contextlib, os, queue, re, threading, time
+
+SLOW_QUERY_MS        = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_EXPLAIN   = os.environ.get("SLOW_QUERY_EXPLAIN", "0") == "1"
+EXPLAIN_COOLDOWN     = float(os.environ.get("EXPLAIN_COOLDOWN_SECONDS", 600))
+QUERY_STATS_SIZE     = int(os.environ.get("QUERY_STATS_SIZE", 200))
+
+_WS      = re.compile(r"\s+")
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+\b")
+_FROM    = re.compile(r"\bFROM\b", re.I)
+_LOCKING = re.compile(r"\bFOR (UPDATE|NO KEY UPDATE|SHARE|KEY SHARE)\b", re.I)
+_EFFECTS = re.compile(r"\b(pg_notify|pg_advisory\w*|nextval|setval)\s*\(", re.I)
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace inline literals so statements group."""
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    return _WS.sub(" ", sql).strip()
+
+def explain_command(sql):
+    """The EXPLAIN to capture sql's plan with, or None to skip it.
+
+    ANALYZE executes the statement, so it is only used for SELECTs that read
+    tables. Writes and locking reads get a plain EXPLAIN; SELECTs of
+    functions (pg_notify, advisory locks, nextval) have no plan worth the
+    side effects and are skipped.
+    """
+    verb = sql.split(" ", 1)[0].upper()
+    if verb in ("UPDATE", "DELETE", "INSERT"):
+        return "EXPLAIN "
+    if verb != "SELECT" or not _FROM.search(sql) or _EFFECTS.search(sql):
+        return None
+    return "EXPLAIN " if _LOCKING.search(sql) else "EXPLAIN (ANALYZE, BUFFERS) "
+
+def param_shape(params):
+    """Types (and list lengths) of the parameters, never their values."""
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {k: param_shape([v])[0] for k, v in params.items()}
+    shape = []
+    for p in params:
+        if isinstance(p, (list, tuple)):
+            shape.append(f"{type(p).__name__}[{len(p)}]")
+        else:
+            shape.append(type(p).__name__)
+    return shape
+
+
+class QueryStats:
+    """Per-process totals per normalized statement, plus captured plans."""
+
+    def __init__(self, size):
+        self.size  = size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, sql, ms, rows, slow, error):
+        with self._lock:
+            s = self._data.get(sql)
+            if s is None:
+                if len(self._data) >= self.size:
+                    sql = "(other)"
+                    s = self._data.get(sql)
+                if s is None:
+                    s = self._data[sql] = {"sql": sql, "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                           "rows": 0, "slow": 0, "errors": 0,
+                                           "plan": None, "plan_at": None}
+            s["calls"]    += 1
+            s["total_ms"] += ms
+            s["max_ms"]    = max(s["max_ms"], ms)
+            s["rows"]     += max(rows, 0)
+            s["slow"]     += slow
+            s["errors"]   += error
+
+    def wants_plan(self, sql):
+        with self._lock:
+            s = self._data.get(sql)
+            return s is not None and (s["plan_at"] is None or time.time() - s["plan_at"] >= EXPLAIN_COOLDOWN)
+
+    def set_plan(self, sql, plan):
+        with self._lock:
+            if sql in self._data:
+                self._data[sql]["plan"]    = plan
+                self._data[sql]["plan_at"] = time.time()
+
+    def top(self, n=20, sort="total_ms"):
+        with self._lock:
+            rows = [dict(s, mean_ms=s["total_ms"] / s["calls"]) for s in self._data.values()]
+        rows.sort(key=lambda s: s[sort], reverse=True)
+        for s in rows:
+            for f in ("total_ms", "max_ms", "mean_ms"):
+                s[f] = round(s[f], 3)
+        return rows[:n]
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+stats = QueryStats(QUERY_STATS_SIZE)
+
+# ── Out-of-band EXPLAIN ───────────────────────────────────────────────────────
+_connect   = None
+_explains  = queue.Queue(maxsize=16)
+_explainer = None
+_explainer_lock = threading.Lock()
+
+def configure(connect):
+    """Give the EXPLAIN worker a way to open its own connection."""
+    global _connect
+    _connect = connect
+
+def _queue_explain(norm, command, sql, params):
+    global _explainer
+    if not (SLOW_QUERY_EXPLAIN and _connect) or not stats.wants_plan(norm):
+        return
+    # Mark as attempted now so a burst of slow calls queues one EXPLAIN.
+    stats.set_plan(norm, "(pending)")
+    try:
+        _explains.put_nowait((norm, command, sql, params))
+    except queue.Full:
+        return
+    with _explainer_lock:
+        if _explainer is None or not _explainer.is_alive() or _explainer.pid != os.getpid():
+            _explainer = threading.Thread(target=_explain_loop, name="explain", daemon=True)
+            _explainer.pid = os.getpid()
+            _explainer.start()
+
+def _explain_loop():
+    while True:
+        norm, command, sql, params = _explains.get()
+        conn = None
+        try:
+            conn = _connect()
+            cur  = conn.cursor()
+            cur.execute(command + sql, params)
+            plan = "\n".join(r[0] for r in cur.fetchall())
+            conn.rollback()
+            stats.set_plan(norm, plan)
+        except Exception as e:
+            stats.set_plan(norm, f"(explain failed: {e})")
+        finally:
+            if conn is not None:
+                conn.close()
+
+# ── Wrapper ───────────────────────────────────────────────────────────────────
+@contextlib.contextmanager
+def timed(cur, sql, params=None, explain=True):
+    """Time whatever runs inside the block as one execution of sql."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        ms   = (time.perf_counter() - start) * 1000
+        norm = normalize_sql(sql)
+        rows = getattr(cur, "rowcount", -1)
+        slow = SLOW_QUERY_MS > 0 and ms >= SLOW_QUERY_MS
+        stats.add(norm, ms, rows, slow, error)
+        if slow:
+            print(f"[SlowQuery] {ms:.1f}ms rows={rows} params={param_shape(params)} sql={norm[:500]}")
+            command = explain and not error and explain_command(norm)
+            if command:
+                _queue_explain(norm, command, sql, params)
+
+def run_query(cur, sql, params=None):
+    """cur.execute(sql, params), timed and recorded."""
+    with timed(cur, sql, params):
+        cur.execute(sql, params)
+    return cur
@@ -0,0 +1,328 @@
+"""
+LegendLua Traffic Replay
+Plays a capture recorded with TRAFFIC_CAPTURE_FILE against one or two local
+builds of the portal and reports latency, errors and outcome differences.
+
+Each build is started from its own directory (python app.py, or gunicorn with
+--workers) on a free port. Storage is a fresh keys.json in a temp dir, or the
+PostgreSQL database given with --database-url (use a scratch database: the
+replay inserts synthetic keys). Captured key hashes are mapped to synthetic
+keys seeded in the state the capture implies (unknown, expired, locked to
+someone else, or valid).
+
+Usage:
+  python replay_traffic.py capture.jsonl --build .
+  python replay_traffic.py capture.jsonl --build ../baseline --build . --speed 10
+"""
+
+import argparse, hashlib, http.client, itertools, json, os, queue, socket, subprocess, sys, tempfile, threading, time
+from datetime import datetime, timedelta, timezone
+import keycodec
+
+ADMIN_PASSWORD = "CertifiedAccessLOL"
+PLAYER_ROUTES  = ("/hub", "/submit", "/verify", "/verify/batch")
+
+# Same response text -> outcome mapping as app.py's capture.
+OUTCOMES = (
+    ("Missing key",          "missing"),
+    ("not found",            "unknown"),
+    ("Invalid key",          "unknown"),
+    ("No key provided",      "missing"),
+    ("expired",              "expired"),
+    ("linked to another",    "conflict"),
+    ("Too many requests",    "throttled"),
+    ("Server busy",          "busy"),
+    ("Unauthorized",         "unauthorized"),
+)
+
+def load_capture(path, limit=None):
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r["t"])
+    return records[:limit] if limit else records
+
+# ── Seeding ───────────────────────────────────────────────────────────────────
+def synthetic_key(khash, salt):
+    n = int(hashlib.sha256((salt + khash).encode()).hexdigest(), 16)
+    return keycodec.decode(n % keycodec.KEY_SPACE)
+
+def synthetic_user(uhash):
+    return f"replay-{uhash}" if uhash else ""
+
+def synthetic_ip(ihash):
+    if not ihash:
+        return "127.0.0.1"
+    n = int(ihash[:6], 16)
+    return f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+def seed_states(records):
+    """Key hash -> state implied by the first captured request that used it."""
+    states = {}
+    for r in records:
+        pairs = r.get("b") or [[r.get("k"), r.get("u")]]
+        for khash, _ in pairs:
+            if khash and khash not in states:
+                states[khash] = {"unknown": None, "expired": "expired",
+                                 "conflict": "locked"}.get(r.get("o"), "valid")
+    return {k: v for k, v in states.items() if v}
+
+def key_record(state):
+    now = datetime.now(timezone.utc)
+    data = {"tier": "1month", "tier_label": "1 Month", "days": 30,
+            "activated": False, "activated_at": None, "expires_at": None,
+            "locked_user": None, "locked_user_at": None,
+            "created_at": (now - timedelta(days=40)).isoformat()}
+    if state == "expired":
+        data.update(activated=True, activated_at=(now - timedelta(days=31)).isoformat(),
+                    expires_at=(now - timedelta(days=1)).isoformat())
+    elif state == "locked":
+        data.update(activated=True, activated_at=(now - timedelta(days=1)).isoformat(),
+                    expires_at=(now + timedelta(days=29)).isoformat(),
+                    locked_user="replay-someone-else", locked_user_at=now.isoformat())
+    return data
+
+def seed_local(data_dir, keys):
+    with open(os.path.join(data_dir, "keys.json"), "w") as f:
+        json.dump({k: key_record(state) for k, state in keys.items()}, f)
+
+def seed_db(database_url, keys):
+    import psycopg2
+    conn = psycopg2.connect(database_url.replace("postgres://", "postgresql://", 1))
+    cur  = conn.cursor()
+    for key, state in keys.items():
+        d = key_record(state)
+        cur.execute("""
+            INSERT INTO keys (key_id, tier, tier_label, days, activated, activated_at,
+                              expires_at, locked_user, locked_user_at, created_at)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            ON CONFLICT (key_id) DO NOTHING
+        """, (keycodec.encode(key), d["tier"], d["tier_label"], d["days"], d["activated"], d["activated_at"],
+              d["expires_at"], d["locked_user"], d["locked_user_at"], d["created_at"]))
+    conn.commit()
+    cur.close(); conn.close()
+
+# ── Running a build ───────────────────────────────────────────────────────────
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_build(build_dir, data_dir, port, args):
+    env = dict(os.environ, PORT=str(port), DATA_DIR=data_dir,
+               RATE_LIMIT_DB=os.path.join(data_dir, "ratelimit.db"))
+    env.pop("TRAFFIC_CAPTURE_FILE", None)
+    env["DATABASE_URL"] = args.database_url or ""
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    if args.workers:
+        cmd = ["gunicorn", "app:app", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+               "--worker-class", "gthread", "--threads", "16"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    log = open(os.path.join(data_dir, "server.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=build_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{build_dir}: server exited, see {log.name}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{build_dir}: server did not start, see {log.name}")
+
+# ── Replay ────────────────────────────────────────────────────────────────────
+def classify(status, body, content_type):
+    if status >= 500 and status != 503:
+        return "error"
+    text = body.decode("utf-8", "replace")
+    if "json" in content_type:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = {}
+        if data.get("success") or "results" in data:
+            return "ok"
+        text = data.get("message", "")
+    elif status < 400:
+        return "ok"
+    for needle, code in OUTCOMES:
+        if needle in text:
+            return code
+    return "fail"
+
+def build_request(rec, keys_by_hash):
+    route = rec["r"]
+    headers = {"X-Forwarded-For": synthetic_ip(rec.get("i")), "Content-Type": "application/json"}
+    key = keys_by_hash.get(rec.get("k")) or (synthetic_key(rec["k"], "unknown") if rec.get("k") else "")
+    if route == "/hub":
+        return "GET", f"/hub?key={key}", None, headers
+    if route == "/submit":
+        return "POST", route, {"key": key}, headers
+    if route == "/verify":
+        return "POST", route, {"key": key, "userId": synthetic_user(rec.get("u"))}, headers
+    if route == "/verify/batch":
+        items = [{"key": keys_by_hash.get(k) or (synthetic_key(k, "unknown") if k else ""),
+                  "userId": synthetic_user(u)} for k, u in rec.get("b", [])]
+        return "POST", route, items, headers
+    if route.startswith("/admin/") and rec["m"] == "GET":
+        headers["X-Admin-Password"] = ADMIN_PASSWORD
+        return "GET", route, None, headers
+    return None  # admin writes aren't replayed
+
+def replay(records, port, keys_by_hash, speed, threads):
+    """Send records at their captured pace (divided by speed).
+
+    Requests for the same key always go through the same lane, so a key's
+    activate/lock/verify sequence reaches the server in captured order.
+    """
+    local = threading.local()
+    results, skipped = [], 0
+    lock = threading.Lock()
+
+    def send(rec, req):
+        method, path, body, headers = req
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            outcome = classify(resp.status, data, resp.getheader("Content-Type", ""))
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close(); local.conn = None
+            status, outcome = 0, "error"
+        ms = (time.perf_counter() - start) * 1000
+        with lock:
+            results.append({"route": rec["r"], "status": status, "ms": ms,
+                            "outcome": outcome, "captured": rec.get("o")})
+
+    def lane_loop(q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            send(*item)
+
+    lanes = [queue.Queue() for _ in range(threads)]
+    workers = [threading.Thread(target=lane_loop, args=(q,), daemon=True) for q in lanes]
+    for w in workers:
+        w.start()
+    spread = itertools.cycle(range(threads))
+
+    t0 = records[0]["t"]
+    start = time.monotonic()
+    for rec in records:
+        req = build_request(rec, keys_by_hash)
+        if req is None:
+            skipped += 1
+            continue
+        delay = start + (rec["t"] - t0) / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        khash = rec.get("k") or next((k for k, _ in rec.get("b") or [] if k), None)
+        lane = int(khash, 16) % threads if khash else next(spread)
+        lanes[lane].put((rec, req))
+    for q in lanes:
+        q.put(None)
+    for w in workers:
+        w.join()
+    return results, skipped, time.monotonic() - start
+
+# ── Reporting ─────────────────────────────────────────────────────────────────
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(results):
+    routes = {}
+    for r in results:
+        routes.setdefault(r["route"], []).append(r)
+    out = {}
+    for route, rs in sorted(routes.items()):
+        ms = [r["ms"] for r in rs]
+        out[route] = {
+            "n": len(rs),
+            "errors": sum(r["outcome"] == "error" for r in rs),
+            "p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99),
+            "match": sum(r["outcome"] == r["captured"] for r in rs) / len(rs),
+        }
+    return out
+
+def print_report(names, summaries):
+    print(f"\n  {'route':16} {'build':12} {'n':>7} {'err':>5} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'match':>6}")
+    routes = sorted(set().union(*summaries))
+    for route in routes:
+        for name, summary in zip(names, summaries):
+            s = summary.get(route)
+            if s:
+                print(f"  {route:16} {name:12} {s['n']:>7} {s['errors']:>5} {s['p50']:>8.1f} "
+                      f"{s['p95']:>8.1f} {s['p99']:>8.1f} {s['match']:>6.0%}")
+        if len(summaries) == 2 and all(route in s for s in summaries):
+            a, b = summaries[0][route], summaries[1][route]
+            delta = lambda f: f"{(b[f] - a[f]) / a[f]:+.0%}" if a[f] else "n/a"
+            print(f"  {'':16} {'delta':12} {'':>7} {b['errors'] - a['errors']:>+5} {delta('p50'):>8} "
+                  f"{delta('p95'):>8} {delta('p99'):>8} {b['match'] - a['match']:>+6.0%}")
+
+def main():
+    p = argparse.ArgumentParser(description="Replay captured LegendLua traffic against local builds.")
+    p.add_argument("capture")
+    p.add_argument("--build", action="append", required=True,
+                   help="directory containing app.py; give twice to compare baseline and candidate")
+    p.add_argument("--speed", type=float, default=1.0, help="time compression (10 = 10x faster)")
+    p.add_argument("--threads", type=int, default=32)
+    p.add_argument("--limit", type=int, help="replay only the first N requests")
+    p.add_argument("--workers", type=int, default=0, help="run gunicorn with N workers instead of app.py")
+    p.add_argument("--database-url", help="scratch PostgreSQL database (default: local keys.json)")
+    p.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the servers")
+    args = p.parse_args()
+    if len(args.build) > 2:
+        p.error("at most two builds")
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        p.error("capture is empty")
+    states = seed_states(records)
+    print(f"=== LegendLua Traffic Replay ===\n\n  {len(records)} requests, {len(states)} keys, speed {args.speed}x")
+
+    names, summaries = [], []
+    for i, build in enumerate(args.build):
+        name = ("baseline", "candidate")[i] if len(args.build) == 2 else "build"
+        data_dir = tempfile.mkdtemp(prefix=f"legendlua-replay-{name}-")
+        salt = f"{name}-{time.time()}"
+        keys_by_hash = {h: synthetic_key(h, salt) for h in states}
+        seeded = {keys_by_hash[h]: s for h, s in states.items()}
+        port = free_port()
+        if not args.database_url:
+            seed_local(data_dir, seeded)
+        proc = start_build(os.path.abspath(build), data_dir, port, args)
+        try:
+            if args.database_url:
+                seed_db(args.database_url, seeded)
+            print(f"  {name}: replaying against {build} on port {port}...")
+            results, skipped, took = replay(records, port, keys_by_hash, args.speed, args.threads)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+        print(f"  {name}: {len(results)} requests in {took:.1f}s ({skipped} admin writes skipped), "
+              f"server log in {data_dir}")
+        names.append(name)
+        summaries.append(summarize(results))
+
+    print_report(names, summaries)
+
+if __name__ == "__main__":
+    main()
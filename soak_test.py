@@ -0,0 +1,287 @@
+"""
+LegendLua Concurrency Soak Test
+Runs the portal under gunicorn with N workers and hammers /submit (first
+activation) and /verify (first user lock) with many clients contending for
+the same few keys at a time. Reports throughput, latency and lock-conflict
+rate, and checks the invariants those two write paths must keep:
+
+  double_lock    two different users were told /verify succeeded for a key
+  lost_lock      the stored locked_user isn't the user who was told "success"
+  expiry_reset   a key's activated_at/expires_at changed after it was set
+
+Storage is a fresh keys.json in a temp dir (local mode), or the PostgreSQL
+database given with --database-url (use a scratch database: the test
+inserts its own keys). Storage is read directly, not through the app.
+
+Usage:
+  python soak_test.py --workers 4 --seconds 30
+  python soak_test.py --database-url postgresql://localhost/legendlua_soak --workers 8
+Exit status is 1 when an invariant is violated.
+"""
+
+import argparse, collections, http.client, json, os, random, shutil, socket, subprocess, sys, tempfile, threading, time
+from datetime import datetime, timedelta, timezone
+import keycodec
+
+# ── Storage ───────────────────────────────────────────────────────────────────
+def new_key_record():
+    return {"tier": "1month", "tier_label": "1 Month", "days": 30,
+            "activated": False, "activated_at": None, "expires_at": None,
+            "locked_user": None, "locked_user_at": None,
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()}
+
+class LocalStorage:
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, "keys.json")
+
+    def seed(self, keys):
+        with open(self.path, "w") as f:
+            json.dump({k: new_key_record() for k in keys}, f)
+
+    def read(self, keys):
+        """{key: (activated_at, expires_at, locked_user)} for keys."""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {k: (d.get("activated_at"), d.get("expires_at"), d.get("locked_user"))
+                for k, d in data.items() if k in keys}
+
+    def close(self):
+        pass
+
+class DbStorage:
+    def __init__(self, database_url):
+        import psycopg2
+        self.conn = psycopg2.connect(database_url.replace("postgres://", "postgresql://", 1))
+        self.conn.autocommit = True
+
+    def seed(self, keys):
+        cur = self.conn.cursor()
+        for key in keys:
+            d = new_key_record()
+            cur.execute("""
+                INSERT INTO keys (key_id, tier, tier_label, days, activated, created_at)
+                VALUES (%s, %s, %s, %s, FALSE, %s)
+            """, (keycodec.encode(key), d["tier"], d["tier_label"], d["days"], d["created_at"]))
+        cur.close()
+
+    def read(self, keys):
+        cur = self.conn.cursor()
+        cur.execute("SELECT key_id, activated_at, expires_at, locked_user FROM keys WHERE key_id = ANY(%s)",
+                    ([keycodec.encode(k) for k in keys],))
+        rows = {keycodec.decode(r[0]): (r[1] and r[1].isoformat(), r[2] and r[2].isoformat(), r[3])
+                for r in cur.fetchall()}
+        cur.close()
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+# ── Server ────────────────────────────────────────────────────────────────────
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(data_dir, port, args):
+    # Rate limits off: the point is to reach the write paths, not the 429s.
+    env = dict(os.environ, PORT=str(port), DATA_DIR=data_dir, DATABASE_URL=args.database_url or "",
+               RATE_LIMIT_DB=os.path.join(data_dir, "ratelimit.db"),
+               RATE_HUB_KEY="0", RATE_HUB_IP="0", RATE_VERIFY_KEY="0", RATE_VERIFY_IP="0",
+               RATE_VERIFY_BATCH_IP="0")
+    env.pop("TRAFFIC_CAPTURE_FILE", None)
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    cmd = ["gunicorn", "app:app", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+           "--worker-class", "gthread", "--threads", str(args.threads)]
+    log = open(os.path.join(data_dir, "server.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited, see {log.name}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"server did not start, see {log.name}")
+
+# ── Load ──────────────────────────────────────────────────────────────────────
+class Soak:
+    """Clients work through the keys in rounds: every round_seconds a fresh
+    set of `hot` keys becomes the target, so each key sees a burst of
+    simultaneous first activations and first locks."""
+
+    def __init__(self, port, keys, args):
+        self.port    = port
+        self.keys    = keys
+        self.args    = args
+        self.lock    = threading.Lock()
+        self.latency = collections.defaultdict(list)  # route -> ms
+        self.counts  = collections.Counter()          # (route, outcome) -> n
+        self.winners = collections.defaultdict(set)   # key -> users told "success"
+        self.stop    = threading.Event()
+
+    def current_keys(self, elapsed):
+        rnd = int(elapsed / self.args.round_seconds)
+        hot = self.args.hot
+        return self.keys[rnd * hot % len(self.keys):][:hot] or self.keys[:hot]
+
+    def client(self, start):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        rng  = random.Random()
+        while not self.stop.is_set():
+            key = rng.choice(self.current_keys(time.monotonic() - start))
+            if rng.random() < self.args.submit_ratio:
+                route, body = "/submit", {"key": key}
+            else:
+                user = f"soak-{key[-4:]}-{rng.randrange(self.args.users)}"
+                route, body = "/verify", {"key": key, "userId": user}
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST", route, body=json.dumps(body), headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                data = resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                status, data = 0, b""
+            ms = (time.perf_counter() - t0) * 1000
+            outcome = self.classify(status, data)
+            with self.lock:
+                self.latency[route].append(ms)
+                self.counts[route, outcome] += 1
+                if route == "/verify" and outcome == "ok":
+                    self.winners[key].add(body["userId"])
+        conn.close()
+
+    @staticmethod
+    def classify(status, data):
+        if status == 503:
+            return "busy"
+        if status != 200:
+            return "error"
+        try:
+            result = json.loads(data)
+        except ValueError:
+            return "error"
+        if result.get("success"):
+            return "ok"
+        return "conflict" if "linked to another" in result.get("message", "") else "fail"
+
+    def run(self, storage):
+        """Drive the load for args.seconds; returns expiry resets seen while polling."""
+        start   = time.monotonic()
+        clients = [threading.Thread(target=self.client, args=(start,), daemon=True)
+                   for _ in range(self.args.clients)]
+        for c in clients:
+            c.start()
+        first, resets = {}, set()
+        while time.monotonic() - start < self.args.seconds:
+            time.sleep(self.args.poll_seconds)
+            self.check_expiry(storage.read(set(self.keys)), first, resets)
+        self.stop.set()
+        for c in clients:
+            c.join()
+        self.check_expiry(storage.read(set(self.keys)), first, resets)
+        return first, resets, time.monotonic() - start
+
+    @staticmethod
+    def check_expiry(rows, first, resets):
+        for key, (activated_at, expires_at, _) in rows.items():
+            if activated_at is None:
+                continue
+            if key not in first:
+                first[key] = (activated_at, expires_at)
+            elif first[key] != (activated_at, expires_at):
+                resets.add(key)
+
+# ── Report ────────────────────────────────────────────────────────────────────
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def report(soak, rows, resets, took):
+    print(f"\n  {'route':8} {'req/s':>8} {'ok':>7} {'conflict':>9} {'fail':>6} {'busy':>6} {'error':>6} {'p50ms':>7} {'p99ms':>7}")
+    for route in ("/submit", "/verify"):
+        n = len(soak.latency[route])
+        c = {o: soak.counts[route, o] for o in ("ok", "conflict", "fail", "busy", "error")}
+        print(f"  {route:8} {n / took:>8.1f} {c['ok']:>7} {c['conflict']:>9} {c['fail']:>6} {c['busy']:>6} "
+              f"{c['error']:>6} {percentile(soak.latency[route], 50):>7.1f} {percentile(soak.latency[route], 99):>7.1f}")
+    verifies = len(soak.latency["/verify"])
+    if verifies:
+        print(f"\n  lock-conflict rate: {soak.counts['/verify', 'conflict'] / verifies:.1%} of /verify")
+
+    violations = {"double_lock": [], "lost_lock": [], "expiry_reset": sorted(resets)}
+    for key, users in soak.winners.items():
+        if len(users) > 1:
+            violations["double_lock"].append(key)
+        stored = rows.get(key, (None, None, None))[2]
+        if len(users) == 1 and stored not in users:
+            violations["lost_lock"].append(key)
+    print(f"\n  keys activated: {sum(1 for r in rows.values() if r[0])}, "
+          f"locked: {sum(1 for r in rows.values() if r[2])}")
+    for name, keys in violations.items():
+        sample = f"  e.g. {', '.join(keys[:3])}" if keys else ""
+        print(f"  {name:13} {len(keys):>5}{sample}")
+    return any(violations.values())
+
+def main():
+    p = argparse.ArgumentParser(description="Soak-test activation and locking under concurrent workers.")
+    p.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    p.add_argument("--threads", type=int, default=16, help="threads per worker")
+    p.add_argument("--clients", type=int, default=32, help="concurrent client connections")
+    p.add_argument("--seconds", type=float, default=30)
+    p.add_argument("--hot", type=int, default=8, help="keys contended at once")
+    p.add_argument("--users", type=int, default=4, help="competing users per key")
+    p.add_argument("--round-seconds", type=float, default=0.5, help="how long a set of hot keys stays hot")
+    p.add_argument("--submit-ratio", type=float, default=0.5, help="share of requests that are /submit")
+    p.add_argument("--poll-seconds", type=float, default=0.05, help="storage polling interval")
+    p.add_argument("--database-url", help="scratch PostgreSQL database (default: local keys.json)")
+    p.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the server")
+    args = p.parse_args()
+
+    rounds   = int(args.seconds / args.round_seconds) + 1
+    keys     = sorted({keycodec.random_key() for _ in range(rounds * args.hot)})
+    data_dir = tempfile.mkdtemp(prefix="legendlua-soak-")
+    storage  = DbStorage(args.database_url) if args.database_url else LocalStorage(data_dir)
+    mode     = "PostgreSQL" if args.database_url else "keys.json (local)"
+    print("=== LegendLua Concurrency Soak ===\n")
+    print(f"  {args.workers} workers x {args.threads} threads, {args.clients} clients, {args.seconds:g}s, "
+          f"{args.hot} hot keys x {args.users} users, storage: {mode}")
+
+    port = free_port()
+    if not args.database_url:
+        storage.seed(keys)
+    proc = start_server(data_dir, port, args)
+    try:
+        if args.database_url:
+            storage.seed(keys)  # after startup so init_db has created/migrated the table
+        soak = Soak(port, keys, args)
+        first, resets, took = soak.run(storage)
+        rows = storage.read(set(keys))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        storage.close()
+
+    failed = report(soak, rows, resets, took)
+    if failed:
+        print(f"\n  FAILED: invariants violated (server log: {data_dir}/server.log)")
+        sys.exit(1)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    print("\n  All invariants held.")
+
+if __name__ == "__main__":
+    main()